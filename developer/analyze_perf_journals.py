@@ -0,0 +1,191 @@
+# Copyright (c) 2020 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Aggregates the performance journals written by the engine, see the
+perf_journal_folder setting, into duration percentiles per metric.
+
+Usage:
+
+    python analyze_perf_journals.py <folder> [--by max_year] [--by machine] [--metric <regex>] [--json]
+
+Each metric is named after the journal event it comes from:
+"startup_phase:<phase>", "menu_build", or "scope:<category>:<name>" for
+the commands, hooks and idle tasks run in a perf_scope.
+
+This script doesn't depend on Toolkit and runs with Python 2.7 and 3.
+"""
+from __future__ import print_function
+
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import sys
+
+PERCENTILES = (50, 90, 99)
+
+
+def read_journal(path):
+    """
+    Reads a journal.
+
+    :param str path: Path of the journal.
+    :returns: Tuple of the session event, or an empty dictionary if the journal
+        doesn't have one, and the list of the other events.
+    """
+    session = {}
+    events = []
+    with open(path, "r") as journal_fh:
+        for line in journal_fh:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # Most likely a line cut short by a crash.
+                continue
+            if event.get("event") == "session":
+                session = event
+            else:
+                events.append(event)
+    return session, events
+
+
+def get_metric_name(event):
+    """
+    :param dict event: Journal event.
+    :returns: Name of the metric the event contributes to, or None if it
+        doesn't have a duration.
+    """
+    if "duration" not in event:
+        return None
+    parts = [event["event"]]
+    for key in ("category", "name"):
+        if key in event:
+            parts.append(str(event[key]))
+    return ":".join(parts)
+
+
+def percentile(values, percent):
+    """
+    :param list values: Sorted values.
+    :param int percent: Percentile to compute, between 0 and 100.
+    :returns: The value at the given percentile, using the nearest rank method.
+    """
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+def aggregate(folder, group_by, metric_filter):
+    """
+    Aggregates the durations of all the journals of a folder.
+
+    :param str folder: Folder holding the journals.
+    :param list group_by: Session fields to group the journals by.
+    :param metric_filter: Compiled regular expression the metric names must match, or None.
+    :returns: Dictionary of metric statistics, keyed by (group, metric name) tuples.
+    """
+    durations = {}
+    sessions = {}
+    for path in sorted(glob.glob(os.path.join(folder, "*.jsonl"))):
+        try:
+            session, events = read_journal(path)
+        except (IOError, OSError) as e:
+            print("Skipping %s: %s" % (path, e), file=sys.stderr)
+            continue
+        group = tuple(str(session.get(key, "unknown")) for key in group_by)
+        sessions[group] = sessions.get(group, 0) + 1
+        for event in events:
+            metric = get_metric_name(event)
+            if metric is None or (metric_filter and not metric_filter.search(metric)):
+                continue
+            durations.setdefault((group, metric), []).append(event["duration"])
+
+    stats = {}
+    for (key, values) in durations.items():
+        values.sort()
+        stat = {
+            "sessions": sessions[key[0]],
+            "count": len(values),
+            "max": values[-1],
+        }
+        for percent in PERCENTILES:
+            stat["p%d" % percent] = percentile(values, percent)
+        stats[key] = stat
+    return stats
+
+
+def print_table(stats, group_by):
+    """
+    Prints the statistics as a table, one row per group and metric.
+
+    :param dict stats: Statistics returned by aggregate.
+    :param list group_by: Session fields the journals were grouped by.
+    """
+    headers = list(group_by) + ["metric", "sessions", "count"] + ["p%d" % p for p in PERCENTILES] + ["max"]
+    rows = []
+    for (group, metric) in sorted(stats):
+        stat = stats[(group, metric)]
+        rows.append(
+            list(group) + [metric, str(stat["sessions"]), str(stat["count"])] +
+            ["%.1f" % stat["p%d" % p] for p in PERCENTILES] + ["%.1f" % stat["max"]]
+        )
+
+    widths = [max([len(headers[i])] + [len(row[i]) for row in rows]) for i in range(len(headers))]
+    for row in [headers] + rows:
+        print("  ".join(cell.ljust(width) for (cell, width) in zip(row, widths)))
+
+
+def main(argv):
+    """
+    Entry point.
+
+    :param list argv: Command line arguments, without the script name.
+    :returns: Exit code.
+    """
+    parser = argparse.ArgumentParser(
+        description="Aggregates tk-3dsmaxplus performance journals into duration percentiles, in milliseconds."
+    )
+    parser.add_argument("folder", help="Folder holding the .jsonl journals.")
+    parser.add_argument(
+        "--by",
+        action="append",
+        default=None,
+        help="Session field to group the journals by, e.g. max_year, max_version, machine or engine_version. "
+             "Can be repeated. Defaults to max_year.",
+    )
+    parser.add_argument("--metric", help="Only report the metrics whose name matches this regular expression.")
+    parser.add_argument("--json", action="store_true", help="Print the statistics as JSON.")
+    args = parser.parse_args(argv)
+
+    group_by = args.by or ["max_year"]
+    metric_filter = re.compile(args.metric) if args.metric else None
+    stats = aggregate(args.folder, group_by, metric_filter)
+    if not stats:
+        print("No journal events found in %s." % args.folder, file=sys.stderr)
+        return 1
+
+    if args.json:
+        output = [
+            dict(stat, metric=metric, **dict(zip(group_by, group)))
+            for ((group, metric), stat) in sorted(stats.items())
+        ]
+        print(json.dumps(output, indent=2, sort_keys=True))
+    else:
+        print_table(stats, group_by)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
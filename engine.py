@@ -13,6 +13,9 @@ A 3ds Max (2015+) engine for Toolkit that uses MaxPlus.
 import os
 import time
 import math
+import hashlib
+import functools
+import contextlib
 import sgtk
 import MaxPlus
 
@@ -21,6 +24,23 @@ class MaxEngine(sgtk.platform.Engine):
     The main Toolkit engine for 3ds Max
     """
 
+    # Default delay, in milliseconds, of the 'delayed' run_at_startup commands.
+    STARTUP_COMMAND_DELAY = 5000
+    # Estimated cost of a run_at_startup command for the idle scheduler, in
+    # milliseconds. High enough for each command to get its own slice.
+    STARTUP_COMMAND_COST = 1000
+
+    # Root of the local copy of the engine while its python package is
+    # imported from it. See import_module.
+    _import_root = None
+
+    # Style rules added on top of the Max styling for Toolkit windows.
+    STYLE_EXTENSION_MARKER = "toolkit 3dsmax style extension"
+    STYLE_EXTENSION = (
+        "\n\n /* %s */ \n\n"
+        "\n\n QDialog#TankDialog > QWidget { background-color: #343434; }\n\n" % STYLE_EXTENSION_MARKER
+    )
+
     @property
     def host_info(self):
         """
@@ -64,8 +84,47 @@ class MaxEngine(sgtk.platform.Engine):
         # __init__() because the initialization may need those
         # variables.
         self._parent_to_max = True
+        self._max_version = None
         self._on_menus_loaded_handler = None
         self._dock_widgets = []
+        self._focus_app = None
+        self._accelerators_enabled = True
+
+        # Manages the apps listed in the lazy_apps setting. See post_app_init.
+        self._lazy_apps = None
+        self._command_usage = None
+        self._command_prewarmer = None
+        self._scheduler = None
+        self._worker_pool = None
+        self._stall_watchdog = None
+        self._memory_report = None
+        # Snapshot taken the last time the memory report command was run.
+        self._last_memory_snapshot = None
+        # Performance journal of the session, see the perf_journal_folder setting.
+        self._perf_journal = None
+        self._pre_app_init_end = None
+        self._profiler = None
+        self._startup_trace = None
+        # [app instance name, start, end] of the app initializations seen so
+        # far, see _trace_app_init.
+        self._app_init_spans = []
+        self._tracing_app_inits = False
+
+        # (category, name, start time) of the operations in progress. See perf_scope.
+        self._active_operations = []
+
+        # Where to save the layout of the menu, and the type of context it is
+        # saved for. See _save_menu_manifest.
+        self._menu_manifest_path = None
+        self._menu_manifest_context_type = None
+
+        # Pending menu rebuild requests. See _request_menu_rebuild.
+        self._menu_rebuild_reasons = []
+        self._menu_rebuilds_avoided = 0
+
+        # Processed stylesheets, keyed by qss file path. Each entry is a
+        # (mtime, stylesheet) tuple. See _get_bundle_stylesheet.
+        self._stylesheet_cache = {}
 
         # proceed about your business
         sgtk.platform.Engine.__init__(self, *args, **kwargs)
@@ -73,6 +132,16 @@ class MaxEngine(sgtk.platform.Engine):
     ##########################################################################################
     # properties
 
+    @property
+    def disk_location(self):
+        """
+        Location of the engine on disk, or of its local copy while its python
+        package is being imported from it. See import_module.
+        """
+        if self._import_root is not None:
+            return self._import_root
+        return sgtk.platform.Engine.disk_location.fget(self)
+
     @property
     def context_change_allowed(self):
         """
@@ -83,14 +152,67 @@ class MaxEngine(sgtk.platform.Engine):
     ##########################################################################################
     # init
 
+    def import_module(self, module_name):
+        """
+        Imports the engine's python package from the local copy of the engine
+        made by the launcher, when there is one. See the launch_shadow_copy
+        setting.
+
+        Core still does the import, so that the package gets the unique
+        namespace and bookkeeping of any other bundle's package. It is only
+        pointed at the local copy, through disk_location.
+
+        :param module_name: Name of the module to import.
+        :returns: The imported module.
+        """
+        shadow_copy_root = self._get_shadow_copy_root()
+        if shadow_copy_root is None:
+            return super(MaxEngine, self).import_module(module_name)
+
+        self._import_root = shadow_copy_root
+        try:
+            return super(MaxEngine, self).import_module(module_name)
+        finally:
+            self._import_root = None
+
+    def _get_shadow_copy_root(self):
+        """
+        :returns: The root of the local copy of this engine, or None if there
+            isn't one, or it is a copy of another install of the engine.
+        """
+        root = os.environ.get("SGTK_3DSMAX_SHADOW_COPY")
+        if not root:
+            return None
+        # The launcher names the copy after the install it was made from.
+        expected_name = "%s-%s" % (
+            os.path.basename(self.disk_location),
+            hashlib.md5(self.disk_location.encode("utf-8")).hexdigest()[:8]
+        )
+        if (os.path.basename(os.path.normpath(root)) != expected_name or
+                not os.path.exists(os.path.join(root, "python", "tk_3dsmaxplus", "__init__.py"))):
+            return None
+        return root
+
     def pre_app_init(self):
         """
         Called before all apps have initialized
         """
-        from sgtk.platform.qt import QtCore
+        from sgtk.platform.qt import QtCore, QtGui
 
+        pre_app_init_start = time.time()
         self.log_debug("%s: Initializing..." % self)
 
+        # This needs to be present for apps as it will be used in show_dialog when perforce asks for login
+        # info very early on.
+        self.tk_3dsmax = self.import_module("tk_3dsmaxplus")
+        self._startup_trace = self.tk_3dsmax.StartupTrace()
+
+        if self.get_setting("maxscript_tracing", False):
+            self.tk_3dsmax.MaxScript.set_tracing(self.log_debug)
+
+        self._menu_manifest_path = os.environ.get(self.tk_3dsmax.MenuGenerator.MANIFEST_ENV_VAR)
+        self._menu_manifest_context_type = self._get_menu_manifest_context_type(self.context)
+
         if self._get_max_version() > MaxEngine.MAXIMUM_SUPPORTED_VERSION:
             # Untested max version
 
@@ -105,7 +227,7 @@ class MaxEngine(sgtk.platform.Engine):
             max_year = self._max_version_to_year(self._get_max_version())
             max_next_year = highest_supported_version + 1
             if max_year >= self.get_setting("compatibility_dialog_min_version", max_next_year):
-                MaxPlus.Core.EvalMAXScript('messagebox "Warning - ' + msg + '" title: "Flow Production Tracking Warning"')
+                self.eval_maxscript('messagebox "Warning - ' + msg + '" title: "Flow Production Tracking Warning"')
 
             # and log the warning
             self.log_warning(msg)
@@ -116,7 +238,7 @@ class MaxEngine(sgtk.platform.Engine):
                    "The Flow Production Tracking integration does not work with 3ds max versions prior to 2016.")
 
             # Display warning dialog
-            MaxPlus.Core.EvalMAXScript('messagebox "Warning - ' + msg + '" title: "Flow Production Tracking Warning"')
+            self.eval_maxscript('messagebox "Warning - ' + msg + '" title: "Flow Production Tracking Warning"')
                            
             # and log the warning
             self.log_warning(msg)
@@ -128,54 +250,105 @@ class MaxEngine(sgtk.platform.Engine):
         pluginsPath = os.path.join(maxpath, "plugins")
         QtCore.QCoreApplication.addLibraryPath(pluginsPath)
 
-        # Window focus objects are used to enable proper keyboard handling by the window instead of 3dsMax's accelerators
-        engine = self
-        class DialogEvents(QtCore.QObject):
-            def eventFilter(self, obj, event):
-                if event.type() == QtCore.QEvent.WindowActivate:
-                    MaxPlus.CUI.DisableAccelerators()
-                elif event.type() == QtCore.QEvent.WindowDeactivate:
-                    MaxPlus.CUI.EnableAccelerators()
-
-                # Remove from tracked dialogs
-                if event.type() == QtCore.QEvent.Close:
-                    if obj in engine._safe_dialog: 
-                        engine._safe_dialog.remove(obj)
-
-                return False
-
-        self.dialogEvents = DialogEvents()
+        # Keyboard events must reach Toolkit dialogs instead of being eaten by
+        # the 3dsMax accelerators, so the accelerators are disabled while a
+        # Toolkit dialog has focus. Focus changes are tracked at the
+        # application level, which means Python only runs when focus actually
+        # moves rather than for every event the dialogs receive.
+        self._focus_app = QtGui.QApplication.instance()
+        if hasattr(self._focus_app, "focusChanged"):
+            self._focus_app.focusChanged.connect(self._on_focus_changed)
+            self.dialogEvents = None
+        else:
+            # Some versions of Max hand back a QCoreApplication, which doesn't
+            # report focus changes. Fall back to watching window activation on
+            # each dialog.
+            self._focus_app = None
+            engine = self
+            class DialogEvents(QtCore.QObject):
+                def eventFilter(self, obj, event):
+                    if event.type() == QtCore.QEvent.WindowActivate:
+                        engine._set_accelerators_enabled(False)
+                    elif event.type() == QtCore.QEvent.WindowDeactivate:
+                        engine._set_accelerators_enabled(True)
+                    return False
+
+            self.dialogEvents = DialogEvents()
 
         # set up a qt style sheet
-        # note! - try to be smart about this and only run
-        # the style setup once per session - it looks like
-        # 3dsmax slows down if this is executed every engine restart.
         #
         # If we're in pre-Qt Max (before 2018) then we'll need to apply the
-        # stylesheet to the QApplication. That's not safe in 2019.3+, as it's
-        # possible that we'll get back a QCoreApplication from Max, which won't
-        # carry references to a stylesheet. In that case, we apply our styling
-        # to the dialog parent, which will be the top-level Max window. 
-        if self._max_version_to_year(self._get_max_version()) < 2018:
-            parent_widget = sgtk.platform.qt.QtCore.QCoreApplication.instance()
-        else:
-            parent_widget = self._get_dialog_parent()
-
-        curr_stylesheet = parent_widget.styleSheet()
-
-        if "toolkit 3dsmax style extension" not in curr_stylesheet:
-            # If we're in pre-2017 Max then we need to handle our own styling. Otherwise
-            # we just inherit from Max.
-            if self._max_version_to_year(self._get_max_version()) < 2017:
-                self._initialize_dark_look_and_feel()
+        # stylesheet to the QApplication. From 2018 onwards, we only style the
+        # dialogs and panels created by Toolkit: changing the stylesheet of the
+        # Max main window makes Qt re-polish the whole Max UI, and that window
+        # keeps paying for the larger stylesheet afterwards. That's also not
+        # safe in 2019.3+ for the application, as it's possible that we'll get
+        # back a QCoreApplication from Max, which won't carry references to a
+        # stylesheet.
+        self._style_application = self._max_version_to_year(self._get_max_version()) < 2018
+
+        style_start = time.time()
+        if self._style_application:
+            # note! - try to be smart about this and only run
+            # the style setup once per session - it looks like
+            # 3dsmax slows down if this is executed every engine restart.
+            app = QtCore.QCoreApplication.instance()
+            curr_stylesheet = app.styleSheet()
+
+            if self.STYLE_EXTENSION_MARKER not in curr_stylesheet:
+                # If we're in pre-2017 Max then we need to handle our own styling. Otherwise
+                # we just inherit from Max.
+                if self._max_version_to_year(self._get_max_version()) < 2017:
+                    self._initialize_dark_look_and_feel()
+
+                app.setStyleSheet(curr_stylesheet + self.STYLE_EXTENSION)
+
+        self._startup_trace.add_span("stylesheet setup", style_start, time.time())
+        self.log_debug(
+            "Stylesheet setup took %.1f ms (applied to %s)." % (
+                (time.time() - style_start) * 1000.0,
+                "the application" if self._style_application else "Toolkit dialogs and panels"
+            )
+        )
+
+        # MaxPlus isn't thread-safe, so all the work has to happen on the main
+        # thread. Work that doesn't need to happen right away goes through
+        # this scheduler, which runs it while Max is idle.
+        self._scheduler = self.tk_3dsmax.MainThreadScheduler(self, self.get_setting("idle_time_budget", 20))
+        # Pure python work, like file system access, can run on worker threads instead.
+        self._worker_pool = self.tk_3dsmax.WorkerPool(self, self.get_setting("worker_threads", 2))
+
+        stall_threshold = self.get_setting("stall_watchdog_threshold", 0)
+        if stall_threshold > 0:
+            self._stall_watchdog = self.tk_3dsmax.StallWatchdog(
+                self,
+                stall_threshold,
+                self.get_setting("stall_watchdog_sample_interval", 50),
+                sgtk.LogManager().log_folder
+            )
+            self._stall_watchdog.start()
 
-            curr_stylesheet += "\n\n /* toolkit 3dsmax style extension */ \n\n"
-            curr_stylesheet += "\n\n QDialog#TankDialog > QWidget { background-color: #343434; }\n\n"        
-            parent_widget.setStyleSheet(curr_stylesheet) 
+        journal_folder = self.get_setting("perf_journal_folder", "")
+        if journal_folder:
+            journal_folder = os.path.expanduser(os.path.expandvars(journal_folder))
+            try:
+                self._perf_journal = self.tk_3dsmax.PerfJournal(
+                    self, journal_folder, self.get_setting("perf_journal_max_files", 20)
+                )
+                self._perf_journal.record_session(
+                    max_version=self._get_max_version(),
+                    max_year=self._max_version_to_year(self._get_max_version()),
+                    engine_version=self.version,
+                )
+            except Exception as e:
+                self.log_warning("Could not create a performance journal in '%s': %s" % (journal_folder, e))
 
-        # This needs to be present for apps as it will be used in show_dialog when perforce asks for login
-        # info very early on.
-        self.tk_3dsmax = self.import_module("tk_3dsmaxplus")
+        if self.get_setting("memory_report_tracemalloc", False):
+            try:
+                import tracemalloc
+                tracemalloc.start()
+            except ImportError:
+                self.log_debug("tracemalloc is not available, memory reports will only compare object counts.")
 
         # The "qss_watcher" setting causes us to monitor the engine's
         # style.qss file and re-apply it on the fly when it changes
@@ -185,7 +358,25 @@ class MaxEngine(sgtk.platform.Engine):
                 [os.path.join(self.disk_location, sgtk.platform.constants.BUNDLE_STYLESHEET_FILE)],
             )
 
-            self._qss_watcher.fileChanged.connect(self.reload_qss)
+            # Editors tend to emit several change notifications for a single
+            # save, so wait for things to settle before reloading.
+            self._qss_reload_timer = QtCore.QTimer()
+            self._qss_reload_timer.setSingleShot(True)
+            self._qss_reload_timer.setInterval(250)
+            self._qss_reload_timer.timeout.connect(self.reload_qss)
+
+            self._qss_watcher.fileChanged.connect(self._qss_reload_timer.start)
+
+        # Read the engine stylesheet now so that opening dialogs later on
+        # doesn't have to go to disk.
+        self._get_bundle_stylesheet(self)
+
+        self._pre_app_init_end = time.time()
+        self._startup_trace.add_span("pre_app_init", pre_app_init_start, self._pre_app_init_end)
+        self._tracing_app_inits = True
+        self.record_perf_event(
+            "startup_phase", name="pre_app_init", duration=(self._pre_app_init_end - pre_app_init_start) * 1000.0
+        )
 
     def _add_shotgun_menu(self):
         """
@@ -208,15 +399,107 @@ class MaxEngine(sgtk.platform.Engine):
 
         :param code: Notification code received
         """
-        self._add_shotgun_menu()
+        self._request_menu_rebuild("menus loaded")
+
+    def _request_menu_rebuild(self, reason):
+        """
+        Schedules a rebuild of the Shotgun menu.
+
+        Rebuilding the menu is expensive, and requests tend to come in bursts,
+        for example when a workspace switch is followed by a context change.
+        All the requests made before Max is next idle are coalesced into a
+        single rebuild.
+
+        :param str reason: Why the rebuild is requested, for logging purposes.
+        """
+        self._menu_rebuild_reasons.append(reason)
+        if len(self._menu_rebuild_reasons) > 1:
+            # A rebuild is already scheduled, it will take care of this request.
+            self._menu_rebuilds_avoided += 1
+            return
+
+        self.schedule_idle_task(
+            self._rebuild_menu, self.tk_3dsmax.MainThreadScheduler.PRIORITY_HIGH, estimated_cost=100
+        )
+
+    def _rebuild_menu(self):
+        """
+        Rebuilds the Shotgun menu for all the pending rebuild requests.
+        """
+        if not self._menu_rebuild_reasons:
+            # The requests were cancelled, most likely because the engine was
+            # destroyed in the meantime.
+            return
+
+        self.log_debug(
+            "Rebuilding the menu (requested by: %s). %d rebuild(s) avoided so far." %
+            (", ".join(self._menu_rebuild_reasons), self._menu_rebuilds_avoided)
+        )
+        self._menu_rebuild_reasons = []
+        start = time.time()
+        with self._startup_trace.span("menu build"):
+            self._remove_shotgun_menu()
+            self._add_shotgun_menu()
+        self.record_perf_event("menu_build", duration=(time.time() - start) * 1000.0)
+        self._save_menu_manifest()
+
+    @staticmethod
+    def _get_menu_manifest_context_type(context):
+        """
+        :param context: Context to get the type of.
+        :returns: The entity type of the context, "Project" or "Site".
+        """
+        if context.entity:
+            return context.entity["type"]
+        return "Project" if context.project else "Site"
+
+    def _save_menu_manifest(self):
+        """
+        Saves the layout of the menu that was just built, for the basic plugin
+        to put it up at the next launch, before the engine has started.
+
+        The launcher gives a manifest path per configuration and type of
+        context it launches 3dsMax in, so the menu is only saved while the
+        context is of that type.
+        """
+        if not self._menu_manifest_path:
+            return
+        if self._get_menu_manifest_context_type(self.context) != self._menu_manifest_context_type:
+            return
+
+        path = self._menu_manifest_path
+        future = self.submit_worker_task(
+            self.tk_3dsmax.MenuGenerator.write_manifest, path, self._menu_generator.manifest
+        )
+
+        def on_done(f):
+            if not f.cancelled() and f.exception() is not None:
+                self.log_debug("Could not save the menu manifest '%s': %s" % (path, f.exception()))
+        future.add_done_callback(on_done)
 
     def post_app_init(self):
         """
         Called when all apps have initialized
         """
+        post_app_init_start = time.time()
+        self._tracing_app_inits = False
+        for (app_instance_name, start, end) in self._app_init_spans:
+            self._startup_trace.add_span("app init: %s" % app_instance_name, start, end)
+
+        if self._pre_app_init_end is not None:
+            self.record_perf_event(
+                "startup_phase", name="app_init", duration=(post_app_init_start - self._pre_app_init_end) * 1000.0
+            )
+
+        # Register the commands of the apps that are only initialized on
+        # first use.
+        self._lazy_apps = self.tk_3dsmax.LazyAppManager(self)
+        self._lazy_apps.register_commands(engine_starting=True)
+        self._register_diagnostics_commands()
+
         # set up menu handler
         self._menu_generator = self.tk_3dsmax.MenuGenerator(self)
-        self._add_shotgun_menu()
+        self._request_menu_rebuild("engine startup")
 
         try:
             # Listen to the CuiMenusPostLoad notification in order to add
@@ -226,13 +509,124 @@ class MaxEngine(sgtk.platform.Engine):
         except AttributeError:
             self.log_debug("CuiMenusPostLoad notification code is not available in this version of MaxPlus.")
 
+        # Cache the app stylesheets once the startup work is done, so that
+        # the first dialog shown by each app doesn't have to read them.
+        self.schedule_idle_task(self._prime_stylesheet_cache, self.tk_3dsmax.MainThreadScheduler.PRIORITY_LOW)
+
         # Run a series of app instance commands at startup.
         self._run_app_instance_commands()
 
         # The new engine is supported only for Max 2017 and up, so recommend an update
         # only for those users.
         if self._max_version_to_year(self._get_max_version()) >= 2017:
-            self.async_execute_in_main_thread(self._show_update_dialog)
+            self.schedule_idle_task(
+                self._show_update_dialog, self.tk_3dsmax.MainThreadScheduler.PRIORITY_LOW, estimated_cost=50
+            )
+
+        # Use idle time to load the code behind the commands used the most.
+        prewarm_count = self.get_setting("prewarm_commands", 0)
+        if prewarm_count > 0:
+            self._command_prewarmer = self.tk_3dsmax.CommandPrewarmer(
+                self, self.command_usage, prewarm_count, self.get_setting("prewarm_time_budget", 1000)
+            )
+            self._command_prewarmer.start()
+
+        self.record_perf_event(
+            "startup_phase", name="post_app_init", duration=(time.time() - post_app_init_start) * 1000.0
+        )
+        self._startup_trace.add_span("post_app_init", post_app_init_start, time.time())
+
+        # Queued last, so that this runs once the startup work queued above is done.
+        self.schedule_idle_task(self._finish_startup_trace, self.tk_3dsmax.MainThreadScheduler.PRIORITY_LOW)
+
+    def _finish_startup_trace(self):
+        """
+        Logs a summary of the startup timeline and writes it as a Chrome trace
+        if the startup_trace setting is on.
+        """
+        end = time.time()
+        start = self._startup_trace.finish()
+        self.log_info(self._startup_trace.summary(start, end))
+
+        if self.get_setting("startup_trace", False):
+            path = os.path.join(
+                sgtk.LogManager().log_folder,
+                "tk-3dsmaxplus-startup-%s-%d.json" % (time.strftime("%Y%m%d-%H%M%S", time.localtime(start)), os.getpid())
+            )
+            try:
+                self._startup_trace.write(path, start)
+                self.log_info("Startup trace written to %s" % path)
+            except Exception as e:
+                self.log_warning("Could not write the startup trace '%s': %s" % (path, e))
+
+    def _register_diagnostics_commands(self):
+        """
+        Registers the commands of the diagnostics_commands setting.
+        """
+        if not self.get_setting("diagnostics_commands", False):
+            return
+        self.register_command(
+            "Memory Report...",
+            self._show_memory_report,
+            {
+                "type": "context_menu",
+                "short_name": "memory_report",
+                "description": "Logs the memory held by Toolkit, and how it changed since the last report."
+            }
+        )
+        self._register_profiling_command()
+
+    def _register_profiling_command(self):
+        """
+        Registers the command toggling the profiling. Its menu label shows
+        whether profiling is on.
+        """
+        self.register_command(
+            "Toggle Profiling",
+            self._toggle_profiling,
+            {
+                "type": "context_menu",
+                "short_name": "toggle_profiling",
+                "menu_label": self._get_profiling_menu_label,
+                "description": "Profiles the commands, publish hooks and idle tasks run until profiling is "
+                               "stopped, and writes the profile to the log folder."
+            }
+        )
+
+    def _get_profiling_menu_label(self):
+        """
+        :returns: The menu label of the Toggle Profiling command.
+        """
+        if self._profiler is not None and self._profiler.active:
+            return "Toggle Profiling (On)"
+        return "Toggle Profiling (Off)"
+
+    def _toggle_profiling(self):
+        """
+        Callback of the Toggle Profiling command.
+        """
+        if self._profiler is None:
+            self._profiler = self.tk_3dsmax.ScopeProfiler(self, sgtk.LogManager().log_folder)
+
+        if self._profiler.active:
+            summary_path = self._profiler.stop()
+            if summary_path:
+                self.log_info("Profile written to %s" % summary_path)
+            else:
+                self.log_info("Profiling stopped, nothing was profiled.")
+        else:
+            self._profiler.start()
+            self.log_info("Profiling started.")
+        # Update the command's label.
+        self.update_shotgun_menu()
+
+    def _show_memory_report(self):
+        """
+        Callback of the Memory Report command.
+        """
+        snapshot = self.take_memory_snapshot()
+        self.log_info(self.format_memory_report(snapshot, self._last_memory_snapshot))
+        self._last_memory_snapshot = snapshot
 
     def _show_update_dialog(self):
         """
@@ -240,9 +634,10 @@ class MaxEngine(sgtk.platform.Engine):
         """
         # We need to keep a ref of the dialog or PySide/Python will garbage collect it before
         # the user dismisses it.
-        if self.tk_3dsmax.UpdateEngineDlg.should_skip_dialog():
-            return
-        self.show_dialog("tk-3dsmaxplus deprecation notice", self, self.tk_3dsmax.UpdateEngineDlg)
+        with self._startup_trace.span("update dialog"):
+            if self.tk_3dsmax.UpdateEngineDlg.should_skip_dialog():
+                return
+            self.show_dialog("tk-3dsmaxplus deprecation notice", self, self.tk_3dsmax.UpdateEngineDlg)
 
     def post_context_change(self, old_context, new_context):
         """
@@ -252,14 +647,24 @@ class MaxEngine(sgtk.platform.Engine):
         :param old_context: The previous context.
         :param new_context: The current, new context.
         """
+        # Lazy apps that were initialized were so in the previous context.
+        # Tear them down, they'll be initialized again when next used.
+        self._lazy_apps.destroy_apps()
+        self._lazy_apps.register_commands()
+        self._register_diagnostics_commands()
+
         # Replacing the menu will cause the old one to be removed
         # and the new one put into its place.
-        self._add_shotgun_menu()
+        self._request_menu_rebuild("context change")
 
     def _run_app_instance_commands(self):
         """
         Runs the series of app instance commands listed in the 'run_at_startup' setting
         of the environment configuration yaml file.
+
+        Each entry is run according to its 'mode': right away for 'immediate',
+        the default, or on the idle scheduler for 'idle' and 'delayed', the
+        latter after waiting for 'delay' milliseconds first.
         """
 
         # Build a dictionary mapping app instance names to dictionaries of commands they registered with the engine.
@@ -267,8 +672,13 @@ class MaxEngine(sgtk.platform.Engine):
         for (command_name, value) in self.commands.iteritems():
             app_instance = value["properties"].get("app")
             if app_instance:
+                app_instance_name = app_instance.instance_name
+            else:
+                # Stand-in command of a lazy app.
+                app_instance_name = value["properties"].get("lazy_app_instance")
+            if app_instance_name:
                 # Add entry 'command name: command function' to the command dictionary of this app instance.
-                command_dict = app_instance_commands.setdefault(app_instance.instance_name, {})
+                command_dict = app_instance_commands.setdefault(app_instance_name, {})
                 command_dict[command_name] = value["callback"]
 
         # Run the series of app instance commands listed in the 'run_at_startup' setting.
@@ -288,16 +698,14 @@ class MaxEngine(sgtk.platform.Engine):
                 if not setting_command_name:
                     # Run all commands of the given app instance.
                     for (command_name, command_function) in command_dict.iteritems():
-                        self.log_debug("%s startup running app '%s' command '%s'." %
-                                       (self.name, app_instance_name, command_name))
-                        command_function()
+                        self._run_startup_command(app_instance_name, command_name, command_function, app_setting_dict)
                 else:
                     # Run the command whose name is listed in the 'run_at_startup' setting.
                     command_function = command_dict.get(setting_command_name)
                     if command_function:
-                        self.log_debug("%s startup running app '%s' command '%s'." %
-                                       (self.name, app_instance_name, setting_command_name))
-                        command_function()
+                        self._run_startup_command(
+                            app_instance_name, setting_command_name, command_function, app_setting_dict
+                        )
                     else:
                         known_commands = ', '.join("'%s'" % name for name in command_dict)
                         self.log_warning(
@@ -305,6 +713,58 @@ class MaxEngine(sgtk.platform.Engine):
                             "Known commands: %s" %
                             (self.name, app_instance_name, setting_command_name, known_commands))
 
+    def _run_startup_command(self, app_instance_name, command_name, command_function, app_setting_dict):
+        """
+        Runs, or schedules, a command listed in the 'run_at_startup' setting.
+
+        :param app_instance_name: Instance name of the app the command belongs to.
+        :param command_name: Name of the command.
+        :param command_function: Callback of the command.
+        :param app_setting_dict: Entry of the 'run_at_startup' setting the command comes from.
+        """
+        from sgtk.platform.qt import QtCore
+
+        mode = app_setting_dict.get("mode") or "immediate"
+        if mode not in ("immediate", "idle", "delayed"):
+            self.log_warning(
+                "%s configuration setting 'run_at_startup' has unknown mode '%s' for app '%s'. "
+                "Running command '%s' immediately." % (self.name, mode, app_instance_name, command_name)
+            )
+            mode = "immediate"
+
+        def run():
+            self.log_debug("%s startup running app '%s' command '%s'." %
+                           (self.name, app_instance_name, command_name))
+            start = time.time()
+            with self._startup_trace.span("run_at_startup: %s" % command_name):
+                command_function()
+            duration = (time.time() - start) * 1000.0
+            self.log_debug("%s startup command '%s' (%s) took %.0f ms." % (self.name, command_name, mode, duration))
+            self.record_perf_event("startup_command", name=command_name, mode=mode, duration=duration)
+
+        if mode == "immediate":
+            run()
+            return
+
+        priority = app_setting_dict.get("priority")
+        if priority is None:
+            priority = self.tk_3dsmax.MainThreadScheduler.PRIORITY_NORMAL
+
+        def schedule():
+            # Commands can take a while, give each one its own slice so that
+            # Max gets a chance to process events in between.
+            self.schedule_idle_task(
+                run, priority, estimated_cost=self.STARTUP_COMMAND_COST, name="run_at_startup: %s" % command_name
+            )
+
+        if mode == "idle":
+            schedule()
+        else:
+            delay = app_setting_dict.get("delay")
+            if delay is None:
+                delay = self.STARTUP_COMMAND_DELAY
+            QtCore.QTimer.singleShot(delay, schedule)
+
     def destroy_engine(self):
         """
         Called when the engine is shutting down
@@ -313,14 +773,267 @@ class MaxEngine(sgtk.platform.Engine):
 
         if self._on_menus_loaded_handler is not None:
             MaxPlus.NotificationManager.Unregister(self._on_menus_loaded_handler)
+
+        # Cancel any pending menu rebuild.
+        self._menu_rebuild_reasons = []
+
+        if self._command_prewarmer is not None:
+            self._command_prewarmer.cancel()
+
+        if self._command_usage is not None:
+            self._command_usage.flush()
+
+        if self._lazy_apps is not None:
+            self._lazy_apps.destroy_apps()
+
+        bridge_stats = self.maxscript_bridge_stats
+        self.log_debug(
+            "MaxScript bridge: %d evaluation(s), %.0f ms in total, %.0f ms at most, %d bytes." % (
+                bridge_stats["calls"], bridge_stats["total_time"] * 1000.0,
+                bridge_stats["max_time"] * 1000.0, bridge_stats["bytes"]
+            )
+        )
+
+        if self._scheduler is not None:
+            self.log_debug("Idle scheduler metrics: %s" % self.idle_scheduler_metrics)
+            self._scheduler.shutdown()
+
+        if self._worker_pool is not None:
+            self._worker_pool.shutdown(timeout=1)
+
+        if self._profiler is not None and self._profiler.active:
+            self._profiler.stop()
+
+        if self._perf_journal is not None:
+            self.record_perf_event("session_end")
+            self._perf_journal.flush()
+
+        if self._stall_watchdog is not None:
+            self._stall_watchdog.stop()
+
+        if self._focus_app is not None:
+            self._focus_app.focusChanged.disconnect(self._on_focus_changed)
+        # Don't leave Max without its keyboard shortcuts.
+        self._set_accelerators_enabled(True)
         self._remove_shotgun_menu()
 
+    def eval_maxscript(self, script):
+        """
+        Evaluates MaxScript code.
+
+        Evaluations made through this method are counted, see
+        :attr:`maxscript_bridge_stats`, and logged when the maxscript_tracing
+        setting is on.
+
+        :param str script: MaxScript code to evaluate.
+        :returns: The value returned by ``MaxPlus.Core.EvalMAXScript``.
+        """
+        return self.tk_3dsmax.MaxScript.evaluate(script)
+
+    @property
+    def maxscript_bridge_stats(self):
+        """
+        Dictionary with the number of MaxScript evaluations made so far, their
+        total and maximum durations, in seconds, and the total size of the
+        evaluated scripts, in bytes. The same counters are available per call
+        site, as a dictionary keyed by "file:line (function)" strings, under
+        the "sites" key.
+        """
+        return self.tk_3dsmax.MaxScript.stats.summary()
+
+    def take_memory_snapshot(self):
+        """
+        Measures the objects held by the engine: the MaxScript callback
+        objects, dialogs, dock widgets, templates, apps and commands.
+
+        When tracemalloc is tracing, e.g. because of the memory_report_tracemalloc
+        setting, the snapshot also includes its allocation statistics.
+
+        :returns: :class:`MemorySnapshot` instance, which can be compared to a later one
+            with :meth:`format_memory_report`.
+        """
+        if self._memory_report is None:
+            self._memory_report = self.tk_3dsmax.MemoryReport(self)
+        return self._memory_report.take_snapshot()
+
+    def format_memory_report(self, snapshot, previous=None):
+        """
+        Formats a memory snapshot as a human readable report.
+
+        :param snapshot: :class:`MemorySnapshot` returned by :meth:`take_memory_snapshot`.
+        :param previous: Earlier snapshot to list the differences from, if any.
+        :returns: The report, as a string.
+        """
+        if self._memory_report is None:
+            self._memory_report = self.tk_3dsmax.MemoryReport(self)
+        return self._memory_report.format(snapshot, previous)
+
+    @contextlib.contextmanager
+    def perf_scope(self, category, name):
+        """
+        Context manager marking an operation as in progress, so that it can
+        be named in the reports about it, like the stall reports, and
+        profiled when profiling is started from the context menu.
+
+        Example::
+
+            with engine.perf_scope("hook", "publish_session"):
+                MaxPlus.FileManager.Save(path)
+
+        :param str category: Kind of operation, e.g. "command" or "hook".
+        :param str name: Name of the operation.
+        """
+        operation = (category, name, time.time())
+        self._active_operations.append(operation)
+        profiler = self._profiler if self._profiler is not None and self._profiler.active else None
+        if profiler is not None:
+            profiler.enter(category, name)
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.exit()
+            self._active_operations.remove(operation)
+            self.record_perf_event(
+                "scope", category=category, name=name, duration=(time.time() - operation[2]) * 1000.0
+            )
+
+    def record_perf_event(self, event, **fields):
+        """
+        Adds an event to the performance journal of the session. Does nothing
+        unless the perf_journal_folder setting is set.
+
+        Durations should be passed in milliseconds, as a ``duration`` field,
+        so that developer/analyze_perf_journals.py can aggregate them.
+
+        :param str event: Name of the event, e.g. "menu_build".
+        :param fields: Values to store with the event. They must be JSON serializable.
+        """
+        if self._perf_journal is None:
+            return
+        if "duration" in fields:
+            fields["duration"] = round(fields["duration"], 1)
+        self._perf_journal.record(event, **fields)
+
+    @property
+    def active_operations(self):
+        """
+        List of the operations in progress, outermost first, as (category,
+        name, start time) tuples. See :meth:`perf_scope`.
+        """
+        return list(self._active_operations)
+
+    def schedule_idle_task(self, callback, priority=None, estimated_cost=1, name=None):
+        """
+        Queues work to run on the main thread while 3ds Max is idle.
+
+        Queued tasks run in priority order, a few at a time, so that the
+        viewport stays interactive. Use this for main thread work that
+        doesn't need to happen right away.
+
+        :param callback: Callable to run, without arguments.
+        :param priority: Priority of the task, lower values run first. One of the
+            ``PRIORITY_*`` values of :class:`MainThreadScheduler`. Defaults to
+            ``PRIORITY_NORMAL``.
+        :param estimated_cost: Estimated time the task takes to run, in milliseconds.
+        :param name: Name of the task, for logging purposes.
+        :returns: :class:`ScheduledTask` instance, which can be used to cancel the task.
+        """
+        if priority is None:
+            priority = self.tk_3dsmax.MainThreadScheduler.PRIORITY_NORMAL
+        return self._scheduler.submit(callback, priority, estimated_cost, name)
+
+    def submit_worker_task(self, func, *args, **kwargs):
+        """
+        Runs a callable on a worker thread, so that it doesn't block 3ds Max.
+
+        This is meant for pure python work like file system access. MaxPlus
+        isn't thread-safe and must not be used by the callable. Use the
+        ``add_done_callback`` method of the returned future to get the result
+        on the main thread.
+
+        :param func: Callable to run.
+        :param args: Positional arguments for the callable.
+        :param kwargs: Keyword arguments for the callable.
+        :returns: :class:`Future` instance.
+        """
+        return self._worker_pool.submit(func, *args, **kwargs)
+
+    @property
+    def idle_scheduler_metrics(self):
+        """
+        Dictionary of metrics about the tasks run by :meth:`schedule_idle_task`:
+        number of tasks submitted, completed, failed and cancelled, current and
+        maximum queue depth, number of slices, number of slices that went over
+        the idle_time_budget setting and longest slice duration in milliseconds.
+        """
+        return self._scheduler.metrics
+
+    @property
+    def command_usage(self):
+        """
+        :class:`CommandUsage` instance keeping count of the commands run from the menu.
+        """
+        if self._command_usage is None:
+            self._command_usage = self.tk_3dsmax.CommandUsage(self)
+        return self._command_usage
+
+    def initialize_lazy_app(self, app_instance_name):
+        """
+        Initializes an app listed in the lazy_apps setting, if it isn't already.
+
+        :param app_instance_name: Instance name of the app.
+        :returns: The app instance, or None if it couldn't be initialized.
+        """
+        return self._lazy_apps.initialize_app(app_instance_name)
+
+    def register_command(self, name, callback, properties=None):
+        """
+        Registers a command with the engine.
+
+        Core only ties the commands registered by the apps it initializes to
+        their app, so do the same for the lazy apps initialized by the engine.
+
+        :param name: Name of the command.
+        :param callback: Callable to run when the command is invoked.
+        :param properties: Dictionary of properties of the command.
+        """
+        if self._lazy_apps is not None and self._lazy_apps.current_app is not None:
+            properties = dict(properties or {})
+            properties.setdefault("app", self._lazy_apps.current_app)
+        sgtk.platform.Engine.register_command(self, name, callback, properties)
+
+        if self._tracing_app_inits:
+            self._trace_app_init(name)
+
+    def _trace_app_init(self, command_name):
+        """
+        Extends the startup span of the app that registered a command.
+
+        Core doesn't tell the engine when it initializes each app, so the
+        initialization of an app is approximated as the time between the
+        last command registered by the previous app and the last command it
+        registers itself.
+        :param command_name: Name of the command that was just registered.
+        """
+        app = self.commands.get(command_name, {}).get("properties", {}).get("app")
+        if app is None:
+            return
+        now = time.time()
+        if self._app_init_spans and self._app_init_spans[-1][0] == app.instance_name:
+            self._app_init_spans[-1][2] = now
+        else:
+            start = self._app_init_spans[-1][2] if self._app_init_spans else self._pre_app_init_end
+            self._app_init_spans.append([app.instance_name, start, now])
+
     def update_shotgun_menu(self):
         """
         Rebuild the shotgun menu displayed in the main menu bar
+
+        The menu is rebuilt on the next event loop iteration, together with
+        any other rebuild requested in the meantime.
         """
-        self._remove_shotgun_menu()
-        self._add_shotgun_menu()
+        self._request_menu_rebuild("update_shotgun_menu")
 
     ##########################################################################################
     # logging
@@ -434,6 +1147,7 @@ class MaxEngine(sgtk.platform.Engine):
 
         # apply external stylesheet
         self._apply_external_stylesheet(bundle, widget_instance)
+        self._apply_engine_stylesheet(dock_widget)
 
         if not main_window.restoreDockWidget(dock_widget):
             # The dock widget cannot be restored from the main window's state,
@@ -497,16 +1211,168 @@ class MaxEngine(sgtk.platform.Engine):
                 dialog.setParent(previous_parent)
                 self.log_debug("AttachQWidgetToMax not available in this version of 3ds Max.")
 
-        dialog.installEventFilter(self.dialogEvents)
+        if self.dialogEvents is not None:
+            dialog.installEventFilter(self.dialogEvents)
 
-        # Add to tracked dialogs (will be removed in eventFilter)
+        # Add to tracked dialogs (will be removed when the dialog is closed)
         self._safe_dialog.append(dialog)
+        dialog.finished.connect(functools.partial(self._on_dialog_finished, dialog))
 
         # Apply the engine-level stylesheet.
-        self._apply_external_styleshet(self, dialog)
+        self._apply_engine_stylesheet(dialog)
 
         return dialog
 
+    def _on_dialog_finished(self, dialog, *args):
+        """
+        Stops tracking a dialog once it has been closed.
+
+        :param dialog: The dialog that was closed.
+        """
+        if dialog in self._safe_dialog:
+            self._safe_dialog.remove(dialog)
+
+    def _on_focus_changed(self, old, new):
+        """
+        Called by Qt when the keyboard focus moves from one widget to another.
+
+        :param old: Widget that lost the focus, if any.
+        :param new: Widget that gained the focus, if any.
+        """
+        self._set_accelerators_enabled(not self._is_in_tracked_dialog(new))
+
+    def _is_in_tracked_dialog(self, widget):
+        """
+        Tells if a widget belongs to a dialog created by the engine, or to a
+        window opened from one of them.
+
+        :param widget: The widget to check. Can be None.
+        :returns: True if the widget is part of a Toolkit dialog, False otherwise.
+        """
+        window = widget.window() if widget is not None else None
+        while window is not None:
+            if window in self._safe_dialog:
+                return True
+            window = window.parentWidget()
+        return False
+
+    def _set_accelerators_enabled(self, enabled):
+        """
+        Enables or disables the 3dsMax keyboard accelerators, skipping the
+        MaxPlus call when they are already in the requested state.
+
+        :param enabled: True to enable the accelerators, False to disable them.
+        """
+        if enabled == self._accelerators_enabled:
+            return
+        if enabled:
+            MaxPlus.CUI.EnableAccelerators()
+        else:
+            MaxPlus.CUI.DisableAccelerators()
+        self._accelerators_enabled = enabled
+
+    def _apply_engine_stylesheet(self, widget):
+        """
+        Applies the engine-level styling to a top-level widget created by
+        Toolkit.
+
+        When the application isn't styled globally, the 3ds Max style
+        extension is added to the widget's stylesheet as well.
+
+        :param widget: Dialog or dock widget to style.
+        """
+        qss_data = self._get_bundle_stylesheet(self) or ""
+        if not self._style_application:
+            qss_data += self.STYLE_EXTENSION
+        if qss_data:
+            widget.setStyleSheet(qss_data)
+
+    def _apply_external_stylesheet(self, bundle, widget):
+        """
+        Apply the std external stylesheet associated with a bundle to a widget.
+
+        Overrides the base implementation so that the style.qss file is only
+        read and processed once per session, instead of every time a dialog
+        or panel is shown. Bundles usually live on network storage, which
+        makes those reads noticeable.
+
+        :param bundle: app/engine/framework instance to load style sheet from
+        :param widget: widget to apply stylesheet to
+        """
+        qss_data = self._get_bundle_stylesheet(bundle)
+        if qss_data:
+            widget.setStyleSheet(qss_data)
+
+    def _apply_external_styleshet(self, bundle, widget):
+        """
+        Legacy spelling of :meth:`_apply_external_stylesheet`, still called by
+        some versions of core.
+        """
+        self._apply_external_stylesheet(bundle, widget)
+
+    def _get_bundle_stylesheet(self, bundle):
+        """
+        Returns the processed content of a bundle's style.qss file, reading it
+        from disk only when it isn't cached yet.
+
+        :param bundle: app/engine/framework instance to get the style sheet of
+        :returns: The stylesheet, with its tokens resolved, or None if the
+                  bundle doesn't have one.
+        """
+        qss_file = os.path.join(bundle.disk_location, sgtk.platform.constants.BUNDLE_STYLESHEET_FILE)
+        if qss_file not in self._stylesheet_cache:
+            self._stylesheet_cache[qss_file] = self._read_stylesheet(qss_file)
+        return self._stylesheet_cache[qss_file][1]
+
+    def _read_stylesheet(self, qss_file):
+        """
+        Reads and processes a stylesheet file.
+
+        :param qss_file: Path to the qss file to read.
+        :returns: A (mtime, stylesheet) tuple. Both values are None if the
+                  file doesn't exist.
+        """
+        try:
+            mtime = os.path.getmtime(qss_file)
+        except OSError:
+            # The file doesn't exist, so there's nothing to apply.
+            return (None, None)
+
+        try:
+            with open(qss_file, "rt") as qss_fh:
+                qss_data = qss_fh.read()
+            self.log_debug("Read std style sheet file '%s'" % qss_file)
+            return (mtime, self._resolve_sg_stylesheet_tokens(qss_data))
+        except Exception as e:
+            # catch-all and issue a warning and continue.
+            self.log_warning("Could not read stylesheet '%s': %s" % (qss_file, e))
+            return (mtime, None)
+
+    def _refresh_stylesheet_cache(self):
+        """
+        Re-reads the cached stylesheets whose file has been modified since
+        they were cached.
+
+        :returns: True if at least one stylesheet changed, False otherwise.
+        """
+        changed = False
+        for (qss_file, (mtime, _)) in self._stylesheet_cache.items():
+            try:
+                current_mtime = os.path.getmtime(qss_file)
+            except OSError:
+                current_mtime = None
+            if current_mtime != mtime:
+                self._stylesheet_cache[qss_file] = self._read_stylesheet(qss_file)
+                changed = True
+        return changed
+
+    def _prime_stylesheet_cache(self):
+        """
+        Caches the stylesheets of all the apps currently running.
+        """
+        for app in self.apps.values():
+            self._get_bundle_stylesheet(app)
+
     def reload_qss(self):
         """
         Causes the style.qss file that comes with the tk-rv engine to
@@ -514,8 +1380,20 @@ class MaxEngine(sgtk.platform.Engine):
         launched.
         """
         self.log_warning("Reloading engine QSS...")
+        if not self._refresh_stylesheet_cache():
+            self.log_debug("No stylesheet changes detected.")
+            return
+
+        qss_watcher = getattr(self, "_qss_watcher", None)
+        if qss_watcher is not None:
+            # Some editors save by replacing the file, which makes the
+            # watcher drop it, so make sure it is still being watched.
+            for qss_file in self._stylesheet_cache:
+                if os.path.exists(qss_file) and qss_file not in qss_watcher.files():
+                    qss_watcher.addPath(qss_file)
+
         for dialog in self.created_qt_dialogs:
-            self._apply_external_styleshet(self, dialog)
+            self._apply_engine_stylesheet(dialog)
             dialog.update()
 
     def show_modal(self, title, bundle, widget_class, *args, **kwargs):
@@ -614,15 +1492,18 @@ class MaxEngine(sgtk.platform.Engine):
         """
         Returns Version integer of max release number.
         """
+        # The version is asked for all the time, and it won't change while Max runs.
+        if self._max_version is not None:
+            return self._max_version
+
         # 3dsMax Version returns a number which contains max version, sdk version, etc...
         version_id = MaxPlus.Application.Get3DSMAXVersion()
         
         # Transform it to a version id
         # (Macro to get 3ds max release from version id)
-        version_number = (version_id >> 16) & 0xffff
-
+        self._max_version = (version_id >> 16) & 0xffff
 
-        return version_number
+        return self._max_version
 
     def _is_at_least_max_2016(self):
         """
@@ -307,7 +307,8 @@ class MaxSessionPublishPlugin(HookBaseClass):
         path = sgtk.util.ShotgunPath.normalize(_session_path())
 
         # ensure the session is saved
-        _save_session(path)
+        with self.parent.engine.perf_scope("hook", "publish_session"):
+            _save_session(path)
 
         # update the item with the saved session path
         item.properties["path"] = path
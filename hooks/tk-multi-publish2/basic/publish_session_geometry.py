@@ -236,7 +236,8 @@ class MaxSessionGeometryPublishPlugin(HookBaseClass):
         try:
             abc_export_cmd = "exportFile @\"%s\" #noPrompt using:AlembicExport" % publish_path
             self.parent.log_debug("Executing command: %s" % abc_export_cmd)
-            MaxPlus.Core.EvalMAXScript(abc_export_cmd)
+            with self.parent.engine.perf_scope("hook", "publish_session_geometry"):
+                self.parent.engine.eval_maxscript(abc_export_cmd)
         except Exception, e:
             raise Exception("Failed to export Alembic Cache: %s" % e)
 
@@ -220,14 +220,15 @@ class MaxStartVersionControlPlugin(HookBaseClass):
         # are appropriate for current os, no double separators, etc.
         path = sgtk.util.ShotgunPath.normalize(_session_path())
 
-        # ensure the session is saved in its current state
-        _save_session(path)
+        with publisher.engine.perf_scope("hook", "start_version_control"):
+            # ensure the session is saved in its current state
+            _save_session(path)
 
-        # get the path to a versioned copy of the file.
-        version_path = publisher.util.get_version_path(path, "v001")
+            # get the path to a versioned copy of the file.
+            version_path = publisher.util.get_version_path(path, "v001")
 
-        # save to the new version path
-        _save_session(version_path)
+            # save to the new version path
+            _save_session(version_path)
         self.logger.info("A version number has been added to the Max file...")
         self.logger.info("  Max file path: %s" % (version_path,))
 
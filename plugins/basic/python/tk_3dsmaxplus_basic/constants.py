@@ -12,3 +12,19 @@
 
 SG_MENU_ITEMS_CATEGORY = "Flow Production Tracking Menu Actions"
 SG_MENU_LABEL = "Flow Production Tracking"
+
+# Number of seconds Max must be idle for before bootstrapping toolkit. See bootstrap_toolkit.
+DEFERRED_BOOTSTRAP_ENV_VAR = "SGTK_3DSMAX_DEFERRED_BOOTSTRAP"
+# Number of seconds after which a deferred bootstrap starts even if Max was never idle.
+DEFERRED_BOOTSTRAP_MAX_WAIT = 300
+# Number of seconds between two checks of whether Max is idle while the bootstrap is deferred.
+DEFERRED_BOOTSTRAP_POLL_INTERVAL = 1
+
+# When set, the configuration is resolved while the user's credentials are
+# checked. See bootstrap_toolkit.
+PREFETCH_CONFIG_ENV_VAR = "SGTK_3DSMAX_PREFETCH_CONFIG"
+
+# Path of the manifest of the last menu built by the engine. See bootstrap_toolkit.
+MENU_MANIFEST_ENV_VAR = "SGTK_3DSMAX_MENU_MANIFEST"
+# Version of the manifests written by the engine's MenuGenerator that the plugin can read.
+MENU_MANIFEST_VERSION = 1
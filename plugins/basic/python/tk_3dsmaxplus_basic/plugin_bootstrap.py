@@ -9,8 +9,11 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 import MaxPlus
+import json
 import os
 import sys
+import threading
+import time
 
 from . import constants
 from . import __name__ as PLUGIN_PACKAGE_NAME
@@ -19,6 +22,24 @@ from . import __name__ as PLUGIN_PACKAGE_NAME
 class PluginProperties(object):
     plugin_root_path = None
     running_as_standalone_plugin = False
+    # True while the bootstrap is deferred, see _defer_bootstrap.
+    bootstrap_deferred = False
+    # Polls whether Max is idle while the bootstrap is deferred, see _IdleWatcher.
+    idle_watcher = None
+    # Configuration resolved in the background, see _ConfigPrefetch.
+    config_prefetch = None
+    # True while the menu of the previous session is displayed, see _create_cached_menu.
+    cached_menu_shown = False
+    # Actions of that menu. Kept alive for as long as the menu may be displayed.
+    cached_menu_actions = []
+    # Names of the commands picked from that menu before the engine started.
+    # None once the engine has started, or the menu was replaced.
+    queued_commands = []
+    # Configuration and context of the last engine that was shut down, as
+    # plain data. Used to restart the engine without going through the
+    # whole bootstrap when the same user logs back in and the configuration
+    # didn't change. See _restart_engine.
+    previous_configuration = None
 
 
 def load(root_path):
@@ -35,8 +56,44 @@ def bootstrap_toolkit(root_path):
     Entry point for toolkit bootstrap in 3dsmax.
     Called by the bootstrap.ms max script.
 
+    When the SGTK_3DSMAX_DEFERRED_BOOTSTRAP environment variable is set to
+    a number of seconds, only a placeholder menu is added right away, and
+    the bootstrap starts when the menu is used or once Max has been idle,
+    without any keyboard or mouse input, for that many seconds.
+
+    When the SGTK_3DSMAX_MENU_MANIFEST environment variable points to the
+    manifest of the menu built by the engine in a previous session, that menu
+    is put up right away. Commands picked from it are run once the engine has
+    started.
+
     :param str root_path: Path to the root folder of the plugin
     """
+    # Remember path, to handle logout/login
+    PluginProperties.plugin_root_path = root_path
+
+    manifest_path = os.environ.get(constants.MENU_MANIFEST_ENV_VAR)
+    if manifest_path:
+        try:
+            _create_cached_menu(manifest_path)
+        except Exception, e:
+            print "Flow Production Tracking: Could not display the menu of the previous session: %s" % e
+            _delete_login_menu()
+
+    delay = os.environ.get(constants.DEFERRED_BOOTSTRAP_ENV_VAR)
+    if delay:
+        try:
+            _defer_bootstrap(float(delay))
+            return
+        except Exception, e:
+            print "Flow Production Tracking: Could not defer the bootstrap, starting it now: %s" % e
+
+    _bootstrap_toolkit_now()
+
+
+def _bootstrap_toolkit_now():
+    """
+    Imports core and logs the user in, which starts the engine.
+    """
 
     # --- Import Core ---
     #
@@ -53,9 +110,6 @@ def bootstrap_toolkit(root_path):
     # Display temporary message in prompt line for maximum 5 secs.
     MaxPlus.StatusPanel.DisplayTempPrompt("Loading Flow Production Tracking integration...", 5000)
 
-    # Remember path, to handle logout/login
-    PluginProperties.plugin_root_path = root_path
-
     try:
         from sgtk_plugin_basic_3dsmax import manifest
         PluginProperties.running_as_standalone_plugin = True
@@ -82,7 +136,12 @@ def bootstrap_toolkit(root_path):
     sgtk_logger = sgtk.LogManager.get_logger(PLUGIN_PACKAGE_NAME)
     sgtk_logger.debug("Booting up toolkit plugin.")
 
-    if sgtk.authentication.ShotgunAuthenticator().get_default_user():
+    default_user = sgtk.authentication.ShotgunAuthenticator().get_default_user()
+    if default_user:
+        if os.environ.get(constants.PREFETCH_CONFIG_ENV_VAR):
+            # Resolve the configuration while the user's credentials are checked.
+            PluginProperties.config_prefetch = _ConfigPrefetch(default_user)
+            PluginProperties.config_prefetch.start()
         # When the user is already authenticated, automatically log him/her in.
         _login_user()
     else:
@@ -122,6 +181,13 @@ def handle_bootstrap_completed(engine):
         engine.register_command("Log Out of Flow Production Tracking", _on_logout, {"type": "context_menu"})
         engine.update_shotgun_menu()
 
+    # The engine replaces the menu of the previous session when it builds its own.
+    queued_commands = PluginProperties.queued_commands or []
+    PluginProperties.queued_commands = None
+    PluginProperties.cached_menu_shown = False
+    for name in queued_commands:
+        _run_engine_command(engine, name)
+
 
 def handle_bootstrap_failed(phase, exception):
     """
@@ -147,6 +213,26 @@ def shutdown_toolkit():
     engine = sgtk.platform.current_engine()
 
     if engine:
+        user = sgtk.get_authenticated_user()
+        try:
+            config_uri = engine.sgtk.configuration_descriptor.get_uri()
+        except Exception:
+            # Not bootstrapped from a configuration descriptor.
+            config_uri = None
+        if user and config_uri:
+            # Only plain data is kept, the Toolkit instance, context and user
+            # must not outlive the session.
+            context = engine.context
+            PluginProperties.previous_configuration = {
+                "login": user.login,
+                "host": user.host,
+                "base_configuration": _get_plugin_info()["base_configuration"],
+                "config_uri": config_uri,
+                "config_path": engine.sgtk.pipeline_configuration.get_path(),
+                "project_id": context.project["id"] if context.project else None,
+                "entity": _get_entity_dict(context.task or context.entity or context.project),
+            }
+
         logger.info("Stopping the Flow Production Tracking engine.")
         # Close the various windows (dialogs, panels, etc.) opened by the engine.
         engine.close_windows()
@@ -156,6 +242,16 @@ def shutdown_toolkit():
         logger.debug("The Flow Production Tracking engine was already stopped!")
 
 
+def _get_entity_dict(entity):
+    """
+    :param entity: Entity dictionary of a context, or None.
+    :returns: A copy of the type and id of the entity, or None.
+    """
+    if entity is None:
+        return None
+    return {"type": entity["type"], "id": entity["id"]}
+
+
 def _on_logout():
     """
     Logs the user out and displays login menu
@@ -197,16 +293,44 @@ def _login_user():
         sgtk_logger.info("Flow Production Tracking login was cancelled by the user.")
         return
 
-    _delete_login_menu()
+    if not PluginProperties.cached_menu_shown:
+        _delete_login_menu()
+
+    prefetch = PluginProperties.config_prefetch
+    PluginProperties.config_prefetch = None
+    if prefetch is not None and not prefetch.is_for(user):
+        prefetch = None
+
+    previous = PluginProperties.previous_configuration
+    PluginProperties.previous_configuration = None
+    if (previous is not None and (previous["login"], previous["host"]) == (user.login, user.host) and
+            previous["base_configuration"] == _get_plugin_info()["base_configuration"]):
+        # Which configuration applies must be looked up again to know whether
+        # it changed since the previous session. That doesn't need a full
+        # resolution, unless one is already under way.
+        if prefetch is None:
+            prefetch = _ConfigPrefetch(user, resolve_only=True, project_id=previous["project_id"])
+            prefetch.start()
+        prefetch.credentials_checked()
+        prefetch.wait(_restart_engine, user, previous, prefetch)
+    elif prefetch is not None:
+        prefetch.credentials_checked()
+        prefetch.wait(_bootstrap_engine, user)
+    else:
+        _bootstrap_engine(user)
 
-    # get information about this plugin (plugin id & base config)
-    plugin_info = _get_plugin_info()
+
+def _bootstrap_engine(user):
+    """
+    Bootstraps the engine for a logged in user.
+
+    :param user: The logged in user.
+    """
+    import sgtk
+    sgtk_logger = sgtk.LogManager.get_logger(PLUGIN_PACKAGE_NAME)
 
     # Create a boostrap manager for the logged in user with the plug-in configuration data.
-    toolkit_mgr = sgtk.bootstrap.ToolkitManager(user)
-    toolkit_mgr.base_configuration = plugin_info["base_configuration"]
-    toolkit_mgr.plugin_id = plugin_info["plugin_id"]
-    toolkit_mgr.bundle_cache_fallback_paths = [os.path.join(PluginProperties.plugin_root_path, "bundle_cache")]
+    toolkit_mgr = _create_toolkit_manager(user)
 
     # Retrieve the Shotgun entity type and id when they exist in the environment.
     # these are passed down through the app launcher when running in zero config
@@ -226,11 +350,442 @@ def _login_user():
     )
 
 
+def _create_toolkit_manager(user):
+    """
+    Creates a bootstrap manager for a user with the plug-in configuration data.
+
+    :param user: The user to bootstrap for.
+    :returns: :class:`sgtk.bootstrap.ToolkitManager` instance.
+    """
+    import sgtk
+
+    plugin_info = _get_plugin_info()
+    toolkit_mgr = sgtk.bootstrap.ToolkitManager(user)
+    toolkit_mgr.base_configuration = plugin_info["base_configuration"]
+    toolkit_mgr.plugin_id = plugin_info["plugin_id"]
+    toolkit_mgr.bundle_cache_fallback_paths = [os.path.join(PluginProperties.plugin_root_path, "bundle_cache")]
+    return toolkit_mgr
+
+
+class _ConfigPrefetch(object):
+    """
+    Resolves and caches the configuration, and the bundles it uses, on a
+    background thread, so that it happens while the user's credentials are
+    checked rather than after.
+
+    Also used to find out whether the configuration changed since the
+    previous session, see _restart_engine. Only which configuration applies
+    is looked up then, without caching it or its bundles.
+    """
+
+    # How often to check whether the prefetch is done, in milliseconds.
+    POLL_INTERVAL = 50
+
+    def __init__(self, user, resolve_only=False, project_id=None):
+        """
+        :param user: The default user, whose configuration is prefetched.
+        :param bool resolve_only: Only look up which configuration applies.
+        :param int project_id: Id of the project to look the configuration
+            up for when resolve_only is set.
+        """
+        self._user = user
+        self._resolve_only = resolve_only
+        self._project_id = project_id
+        self._thread = threading.Thread(target=self._run, name="tk-3dsmaxplus-config-prefetch")
+        self._thread.daemon = True
+        self._start = None
+        self._end = None
+        self._credentials_end = None
+        self._error = None
+        # URI of the resolved configuration descriptor.
+        self.config_uri = None
+
+    def start(self):
+        """
+        Starts resolving the configuration.
+        """
+        self._start = time.time()
+        self._thread.start()
+
+    def is_for(self, user):
+        """
+        :param user: A logged in user.
+        :returns: True if the configuration is prefetched for that user.
+        """
+        return (self._user.login, self._user.host) == (user.login, user.host)
+
+    def credentials_checked(self):
+        """
+        Records that the user's credentials have been checked.
+        """
+        self._credentials_end = time.time()
+
+    def wait(self, callback, *args):
+        """
+        Calls a callable once the prefetch is done, without blocking Max.
+
+        :param callback: Callable to call.
+        :param args: Arguments for the callable.
+        """
+        if self._thread.is_alive():
+            from sgtk.util.qt_importer import QtImporter
+            QtImporter().QtCore.QTimer.singleShot(self.POLL_INTERVAL, lambda: self.wait(callback, *args))
+            return
+        self._report()
+        callback(*args)
+
+    def _run(self):
+        """
+        Prefetch thread.
+        """
+        try:
+            if self._resolve_only:
+                descriptor = _resolve_config_descriptor(self._user, self._project_id)
+            else:
+                toolkit_mgr = _create_toolkit_manager(self._user)
+                (_, descriptor) = toolkit_mgr.prepare_engine(
+                    "tk-3dsmaxplus", toolkit_mgr.get_entity_from_environment()
+                )
+            self.config_uri = descriptor.get_uri()
+        except Exception, e:
+            # The bootstrap will run into the same problem and report it.
+            self._error = e
+        self._end = time.time()
+
+    def _report(self):
+        """
+        Reports how much of the prefetch overlapped with the credentials check.
+        """
+        if self._error is not None:
+            progress_callback(0.0, "Could not prefetch the configuration: %s" % self._error)
+            return
+        overlap = max(0.0, min(self._end, self._credentials_end) - self._start)
+        progress_callback(
+            0.0,
+            "Configuration resolved in %.1f seconds, %.1f of which overlapped with the credentials check." % (
+                self._end - self._start, overlap
+            )
+        )
+
+
+def _resolve_config_descriptor(user, project_id):
+    """
+    Looks up which configuration the bootstrap would use for a project,
+    without caching it or its bundles like the bootstrap does.
+
+    :param user: The user to look the configuration up for.
+    :param int project_id: Id of the project, or None for the site configuration.
+    :returns: The configuration descriptor.
+    """
+    from sgtk.bootstrap.resolver import ConfigurationResolver
+
+    plugin_info = _get_plugin_info()
+    resolver = ConfigurationResolver(
+        plugin_id=plugin_info["plugin_id"],
+        project_id=project_id,
+        bundle_cache_fallback_paths=[os.path.join(PluginProperties.plugin_root_path, "bundle_cache")]
+    )
+    config = resolver.resolve_shotgun_configuration(
+        None, plugin_info["base_configuration"], user.create_sg_connection(), user.login
+    )
+    return config.descriptor
+
+
+def _restart_engine(user, previous, prefetch):
+    """
+    Starts the engine again in the configuration and context of the previous
+    session, when the configuration that applies to the user logging back in
+    is the one that session ran with. Bootstraps the engine otherwise.
+
+    This skips swapping core, and caching the configuration and its bundles,
+    which are already done, making logging out and back in much faster.
+
+    :param user: The user logging in, who is the user of the previous session.
+    :param previous: The previous configuration, see :class:`PluginProperties`.
+    :param prefetch: :class:`_ConfigPrefetch` that resolved the configuration.
+    """
+    import sgtk
+    sgtk_logger = sgtk.LogManager.get_logger(PLUGIN_PACKAGE_NAME)
+
+    if prefetch.config_uri != previous["config_uri"]:
+        sgtk_logger.info(
+            "The configuration changed since the previous session (%s, was %s), bootstrapping the engine." %
+            (prefetch.config_uri, previous["config_uri"])
+        )
+        _bootstrap_engine(user)
+        return
+
+    sgtk_logger.info("Restarting the 3dsmaxplus engine with the previous configuration.")
+    start = time.time()
+    try:
+        sgtk.set_authenticated_user(user)
+        tk = sgtk.sgtk_from_path(previous["config_path"])
+        if previous["entity"]:
+            context = tk.context_from_entity_dictionary(previous["entity"])
+        else:
+            context = tk.context_empty()
+        engine = sgtk.platform.start_engine("tk-3dsmaxplus", tk, context)
+    except Exception:
+        sgtk_logger.exception("Could not restart the engine, bootstrapping it again.")
+        _bootstrap_engine(user)
+        return
+
+    progress_callback(1.0, "Engine restarted in %.1f seconds." % (time.time() - start))
+    handle_bootstrap_completed(engine)
+
+
+def _defer_bootstrap(delay):
+    """
+    Adds a placeholder menu, and starts the bootstrap when it is used or
+    once Max has been idle for a while.
+
+    See _IdleWatcher for what idle means. In case the artist never stops
+    working, the bootstrap starts anyway after
+    constants.DEFERRED_BOOTSTRAP_MAX_WAIT seconds.
+
+    :param float delay: Number of idle seconds to wait for before starting the bootstrap.
+    """
+    if not PluginProperties.cached_menu_shown:
+        _delete_login_menu()
+
+        mb = MaxPlus.MenuBuilder(constants.SG_MENU_LABEL)
+        start_action = MaxPlus.ActionFactory.Create(
+            constants.SG_MENU_ITEMS_CATEGORY, "Start Flow Production Tracking", _start_deferred_bootstrap)
+        mb.AddItem(start_action)
+
+        main_menu = MaxPlus.MenuManager.GetMainMenu()
+        # Add menu item at the second to last position,
+        # which should be before "Help"
+        mb.Create(main_menu, main_menu.GetNumItems() - 1)
+
+    PluginProperties.bootstrap_deferred = True
+    PluginProperties.idle_watcher = _IdleWatcher(delay)
+    PluginProperties.idle_watcher.start()
+
+
+class _IdleWatcher(object):
+    """
+    Starts the deferred bootstrap once Max has been idle for long enough.
+
+    Rather than watching every event, this checks every
+    constants.DEFERRED_BOOTSTRAP_POLL_INTERVAL seconds for signs of activity.
+    On Windows, that is the time of the last keyboard or mouse input. The
+    mouse buttons, cursor position and open popups or modal dialogs are
+    checked as well, and are all there is on other platforms.
+
+    Core isn't imported yet, so this uses the Qt bindings shipped with Max.
+    """
+
+    def __init__(self, delay):
+        """
+        :param float delay: Number of idle seconds to wait for before starting the bootstrap.
+        """
+        try:
+            from PySide2 import QtCore, QtGui, QtWidgets
+            self._application = QtWidgets.QApplication
+        except ImportError:
+            from PySide import QtCore, QtGui
+            self._application = QtGui.QApplication
+        self._timer = QtCore.QTimer
+        self._cursor = QtGui.QCursor
+        self._no_button = QtCore.Qt.NoButton
+
+        self._delay = delay
+        # Both are set on the first check, once Max is done starting up.
+        self._deadline = None
+        self._idle_since = None
+        self._cursor_pos = None
+
+    def start(self):
+        """
+        Schedules the next check. The timer only runs once Max processes
+        events, i.e. when it's done starting up.
+        """
+        self._timer.singleShot(int(constants.DEFERRED_BOOTSTRAP_POLL_INTERVAL * 1000), self._check)
+
+    def _check(self):
+        """
+        Starts the bootstrap if Max has been idle for long enough, or checks
+        again later.
+        """
+        if PluginProperties.idle_watcher is not self:
+            # The bootstrap was started from the menu.
+            return
+
+        now = time.time()
+        if self._deadline is None:
+            self._deadline = now + constants.DEFERRED_BOOTSTRAP_MAX_WAIT
+        if self._is_busy() or self._idle_since is None:
+            self._idle_since = now
+        idle_time = now - self._idle_since
+
+        input_idle_time = _get_input_idle_time()
+        if input_idle_time is not None:
+            idle_time = min(idle_time, input_idle_time)
+
+        if idle_time >= self._delay or now >= self._deadline:
+            _start_deferred_bootstrap()
+        else:
+            self.start()
+
+    def _is_busy(self):
+        """
+        :returns: True if the artist is using the mouse, or a popup or a modal dialog is open.
+        """
+        cursor_pos = self._cursor.pos()
+        cursor_moved = self._cursor_pos is not None and cursor_pos != self._cursor_pos
+        self._cursor_pos = cursor_pos
+        return (
+            cursor_moved
+            or self._application.mouseButtons() != self._no_button
+            or self._application.activePopupWidget() is not None
+            or self._application.activeModalWidget() is not None
+        )
+
+
+def _get_input_idle_time():
+    """
+    :returns: Number of seconds since the last keyboard or mouse input, or
+        None if it can't be told on this platform.
+    """
+    if sys.platform != "win32":
+        return None
+
+    import ctypes
+
+    class LASTINPUTINFO(ctypes.Structure):
+        _fields_ = [("cbSize", ctypes.c_uint), ("dwTime", ctypes.c_uint)]
+
+    info = LASTINPUTINFO()
+    info.cbSize = ctypes.sizeof(info)
+    if not ctypes.windll.user32.GetLastInputInfo(ctypes.byref(info)):
+        return None
+    # Both are in milliseconds since the system started, and wrap around after 49.7 days.
+    elapsed = (ctypes.windll.kernel32.GetTickCount() - info.dwTime) & 0xFFFFFFFF
+    return elapsed / 1000.0
+
+
+def _start_deferred_bootstrap():
+    """
+    Starts the deferred bootstrap, unless it already started.
+    """
+    if not PluginProperties.bootstrap_deferred:
+        return
+    PluginProperties.bootstrap_deferred = False
+    PluginProperties.idle_watcher = None
+
+    # The engine, or the login menu, replaces the placeholder menu.
+    if not PluginProperties.cached_menu_shown:
+        _delete_login_menu()
+    _bootstrap_toolkit_now()
+
+
+def _create_cached_menu(manifest_path):
+    """
+    Puts up the menu built by the engine in a previous session, as described
+    by its manifest. See the engine's MenuGenerator.
+
+    Picking a command from it queues the command, which is run once the
+    engine has started. See handle_bootstrap_completed.
+
+    :param str manifest_path: Path to the manifest.
+    """
+    try:
+        with open(manifest_path, "r") as manifest_fh:
+            manifest = json.load(manifest_fh)
+    except (IOError, OSError, ValueError):
+        # No menu was saved for this configuration and type of context yet.
+        return
+    if manifest.get("version") != constants.MENU_MANIFEST_VERSION:
+        return
+
+    def create_action(item):
+        name = item["name"]
+        action = MaxPlus.ActionFactory.Create(
+            constants.SG_MENU_ITEMS_CATEGORY, name, lambda: _on_cached_menu_command(name))
+        PluginProperties.cached_menu_actions.append(action)
+        return action
+
+    _delete_login_menu()
+
+    mb = MaxPlus.MenuBuilder(constants.SG_MENU_LABEL)
+    # (position, item) of the submenus, which are added once the menu exists.
+    submenus = []
+    position = 0
+    for item in manifest["items"]:
+        if item.get("separator"):
+            mb.AddSeparator()
+        elif item.get("submenu"):
+            if not item["items"]:
+                continue
+            submenus.append((position, item))
+        else:
+            mb.AddItem(create_action(item))
+        position += 1
+
+    main_menu = MaxPlus.MenuManager.GetMainMenu()
+    # Add menu item at the second to last position,
+    # which should be before "Help"
+    menu = mb.Create(main_menu, main_menu.GetNumItems() - 1)
+    for (position, item) in submenus:
+        sub_mb = MaxPlus.MenuBuilder(item["title"])
+        for sub_item in item["items"]:
+            sub_mb.AddItem(create_action(sub_item))
+        sub_mb.Create(menu, position)
+
+    PluginProperties.cached_menu_shown = True
+
+
+def _on_cached_menu_command(name):
+    """
+    Called when a command is picked from the menu of the previous session.
+
+    :param str name: Name of the command.
+    """
+    if PluginProperties.queued_commands is None:
+        # The engine has started, but hasn't replaced the menu yet.
+        import sgtk
+        engine = sgtk.platform.current_engine()
+        if engine:
+            _run_engine_command(engine, name)
+        return
+
+    if name not in PluginProperties.queued_commands:
+        PluginProperties.queued_commands.append(name)
+    MaxPlus.StatusPanel.DisplayTempPrompt(
+        "Flow Production Tracking is starting, '%s' will run once it is ready." % name, 5000)
+    # Don't wait for the deferred bootstrap any longer.
+    _start_deferred_bootstrap()
+
+
+def _run_engine_command(engine, name):
+    """
+    Runs a command registered by the engine.
+
+    :param engine: Running :class:`sgtk.platform.Engine` instance.
+    :param str name: Name of the command.
+    """
+    command = engine.commands.get(name)
+    if command is None:
+        print "Flow Production Tracking: '%s' isn't available in this session." % name
+        return
+    try:
+        command["callback"]()
+    except Exception:
+        engine.logger.exception("Failed to run '%s'." % name)
+
+
 def _create_login_menu():
     """
     Creates and displays a Shotgun user login menu.
     """
 
+    if PluginProperties.queued_commands:
+        print "Flow Production Tracking: Not running %s, the engine didn't start." % (
+            ", ".join("'%s'" % name for name in PluginProperties.queued_commands))
+    PluginProperties.queued_commands = None
+    PluginProperties.cached_menu_shown = False
+
     _delete_login_menu()
 
     mb = MaxPlus.MenuBuilder(constants.SG_MENU_LABEL)
@@ -7,8 +7,14 @@
 # By accessing, using, copying or modifying this work you indicate your 
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
 # not expressly granted therein are reserved by Shotgun Software Inc.
+import compileall
+import io
+import json
 import os
+import shutil
 import sys
+import threading
+import time
 
 import MaxPlus
 
@@ -16,6 +22,35 @@ import MaxPlus
 # started to be distributed with it.
 SSL_INCLUDED_VERSION = 20000
 
+# Spans of the startup timeline, passed to the engine through this
+# environment variable. See tk_3dsmaxplus.StartupTrace.
+STARTUP_SPANS_ENV_VAR = "SGTK_3DSMAX_STARTUP_SPANS"
+_startup_spans = []
+
+# File, at the root of a plugin, listing the modules to import to load it.
+# See load_plugin.
+PLUGIN_INDEX_FILE = "plugin_index.json"
+PLUGIN_INDEX_VERSION = 1
+
+# Context written by the launcher to a temporary folder of its own. These
+# must match the launcher's, see startup.py.
+CONTEXT_HANDOFF_PREFIX = "tk-3dsmaxplus-launch-"
+CONTEXT_HANDOFF_FILE = "context.json"
+CONTEXT_HANDOFF_VERSION = 1
+
+# Size of the reads done to prefetch SGTK_FILE_TO_OPEN, in bytes.
+FILE_PREFETCH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def record_span(name, start):
+    """
+    Records a span of the startup timeline, ending now.
+    :param name: Name of the span
+    :param start: Start time of the span, as returned by time.time()
+    """
+    _startup_spans.append([name, start, time.time()])
+    os.environ[STARTUP_SPANS_ENV_VAR] = json.dumps(_startup_spans)
+
 def error(msg):
     """
     Error Repost
@@ -24,6 +59,136 @@ def error(msg):
     print "ERROR: %s" % msg
 
 
+def compile_shadow_copy(root):
+    """
+    Compiles the python files of the local copy of the engine made by the
+    launcher, see its launch_shadow_copy setting. This is only done when the
+    copy changed since the last time.
+    :param root: Root folder of the local copy
+    """
+    manifest_path = os.path.join(root, "shadow_copy_manifest.json")
+    marker_path = os.path.join(root, "compiled")
+    try:
+        manifest_mtime = str(os.path.getmtime(manifest_path))
+        if os.path.exists(marker_path):
+            with open(marker_path, "r") as marker_fh:
+                if marker_fh.read() == manifest_mtime:
+                    return
+
+        start = time.time()
+        for folder in [os.path.join(root, "python", "startup"), os.path.join(root, "python", "tk_3dsmaxplus"),
+                       os.path.join(root, "plugins")]:
+            compileall.compile_dir(folder, quiet=1)
+        with open(marker_path, "w") as marker_fh:
+            marker_fh.write(manifest_mtime)
+        record_span("shadow copy compilation", start)
+    except Exception, e:
+        error("Could not compile the local copy of the engine: %s" % e)
+
+
+class FilePrefetch(object):
+    """
+    Reads a file from start to end on a background thread, so that it is in
+    the OS page cache by the time 3dsMax opens it. The data read is thrown
+    away, and no MaxPlus calls are made from the thread.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the file to prefetch
+        """
+        self.path = path
+        self.start = None
+        self.end = None
+        self.size = 0
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name="tk-3dsmaxplus-file-prefetch")
+        self._thread.daemon = True
+
+    def start_prefetch(self):
+        """
+        Starts reading the file.
+        """
+        self.start = time.time()
+        self._thread.start()
+
+    def _run(self):
+        """
+        Prefetch thread.
+        """
+        try:
+            buf = bytearray(FILE_PREFETCH_CHUNK_SIZE)
+            with io.open(self.path, "rb", buffering=0) as file_fh:
+                while True:
+                    read = file_fh.readinto(buf)
+                    if not read:
+                        break
+                    self.size += read
+        except Exception, e:
+            self.error = e
+        self.end = time.time()
+
+    def report(self):
+        """
+        Records the prefetch in the startup timeline, and returns a summary.
+        :returns: Description of how far the prefetch got
+        """
+        if self.error is not None:
+            return "prefetch failed after %.1f s: %s" % (time.time() - self.start, self.error)
+        if self.end is None:
+            return "prefetch still running, %d MB read in %.1f s" % (self.size / (1024 * 1024), time.time() - self.start)
+        _startup_spans.append(["SGTK_FILE_TO_OPEN prefetch", self.start, self.end])
+        os.environ[STARTUP_SPANS_ENV_VAR] = json.dumps(_startup_spans)
+        return "prefetched %d MB in %.1f s" % (self.size / (1024 * 1024), self.end - self.start)
+
+
+def open_file(file_to_open, prefetch):
+    """
+    Opens the file the launcher was asked to open.
+    :param file_to_open: Path of the file
+    :param prefetch: :class:`FilePrefetch` of the file, or None
+    """
+    start = time.time()
+    MaxPlus.FileManager.Open(file_to_open)
+    record_span("SGTK_FILE_TO_OPEN loading", start)
+
+    message = "Flow Production Tracking: Opened %s in %.1f s" % (file_to_open, time.time() - start)
+    if prefetch is not None:
+        message += ", %s" % prefetch.report()
+    print message
+
+
+def read_context_handoff(handoff_path):
+    """
+    Reads the context the launcher wrote to a file, and deletes the
+    temporary folder holding it.
+    :param handoff_path: Path of the file, see the launcher's _write_context_handoff
+    :returns: The serialized context
+    """
+    try:
+        with open(handoff_path, "r") as handoff_fh:
+            handoff = json.load(handoff_fh)
+    finally:
+        delete_context_handoff(handoff_path)
+    if handoff.get("version") != CONTEXT_HANDOFF_VERSION:
+        raise ValueError("Unsupported version %s of the context handoff %s" % (handoff.get("version"), handoff_path))
+    return handoff["context"]
+
+def delete_context_handoff(handoff_path):
+    """
+    Deletes the temporary folder holding the context written by the
+    launcher. Anything that doesn't look like one of those folders is left
+    alone.
+    :param handoff_path: Path of the file, see the launcher's _write_context_handoff
+    """
+    handoff_folder = os.path.dirname(handoff_path)
+    if (os.path.basename(handoff_path) != CONTEXT_HANDOFF_FILE or
+            not os.path.basename(handoff_folder).startswith(CONTEXT_HANDOFF_PREFIX)):
+        error("Not deleting %s, it isn't a context handoff folder." % handoff_folder)
+        return
+    shutil.rmtree(handoff_folder, ignore_errors=True)
+
+
 def bootstrap_sgtk_classic():
     """
     Parse environment variables for an engine name and
@@ -31,11 +196,15 @@ def bootstrap_sgtk_classic():
     the tk-3dsmaxplus engine and environment.
     """
 
+    start = time.time()
     try:
         import sgtk
     except Exception, e:
         error("Could not import sgtk! Disabling for now: %s" % e)
+        if "SGTK_3DSMAX_CONTEXT_HANDOFF" in os.environ:
+            delete_context_handoff(os.environ["SGTK_3DSMAX_CONTEXT_HANDOFF"])
         return
+    record_span("sgtk import", start)
 
     sgtk.LogManager().initialize_base_file_handler("tk-3dsmaxplus")
     logger = sgtk.LogManager.get_logger(__name__)
@@ -43,48 +212,102 @@ def bootstrap_sgtk_classic():
     if not "TANK_ENGINE" in os.environ:
         logger.error("Missing required environment variable TANK_ENGINE.")
         error("Flow Production Tracking: Missing required environment variable TANK_ENGINE.")
+        if "SGTK_3DSMAX_CONTEXT_HANDOFF" in os.environ:
+            delete_context_handoff(os.environ["SGTK_3DSMAX_CONTEXT_HANDOFF"])
         return
 
     engine_name = os.environ.get("TANK_ENGINE")
+    start = time.time()
     try:
-        context = sgtk.context.deserialize(os.environ.get("TANK_CONTEXT"))
+        handoff_path = os.environ.get("SGTK_3DSMAX_CONTEXT_HANDOFF")
+        if handoff_path:
+            serialized_context = read_context_handoff(handoff_path)
+        else:
+            serialized_context = os.environ.get("TANK_CONTEXT")
+        context = sgtk.context.deserialize(serialized_context)
     except Exception, e:
         logger.exception("Could not create context! sgtk will be disabled.")
         error("Flow Production Tracking: Could not create context! sgtk will be disabled. Details: %s" % e)
         return
+    record_span("context deserialization", start)
 
+    start = time.time()
     try:
         sgtk.platform.start_engine(engine_name, context.tank, context)
     except Exception, e:
         logger.exception("Could not start engine")
         error("Flow Production Tracking: Could not start engine: %s" % e)
         return
+    record_span("start_engine", start)
 
 def bootstrap_sgtk_with_plugins():
     """
     Parse environment variables for a list of plugins to load that will
     ultimately startup Toolkit and the tk-3dsmaxplus engine and environment.
     """
+    start = time.time()
     import sgtk
+    record_span("sgtk import", start)
     logger = sgtk.LogManager.get_logger(__name__)
 
     logger.debug("Launching 3dsMax in plugin mode")
 
-    # Load all plugins by calling the 'load()' entry point.
     for plugin_path in os.environ["SGTK_LOAD_MAX_PLUGINS"].split(os.pathsep):
+        load_plugin(plugin_path, logger)
+
+def load_plugin(plugin_path, logger):
+    """
+    Loads a plugin by importing its modules and calling their entry point.
+
+    The modules, and their entry point, are listed in the plugin_index.json
+    file at the root of the plugin, e.g.
+    {"version": 1, "python_path": "python", "modules": [{"name": "my_plugin", "entry_point": "load"}]}
+    Without an index, every module of the plugin's python folder is
+    imported and its load() function called.
+    :param plugin_path: Root folder of the plugin
+    :param logger: Logger to report to
+    """
+    plugin_start = time.time()
+    try:
+        with open(os.path.join(plugin_path, PLUGIN_INDEX_FILE), "r") as index_fh:
+            index = json.load(index_fh)
+    except (IOError, OSError, ValueError):
+        index = None
+
+    if index and index.get("version") == PLUGIN_INDEX_VERSION:
+        plugin_python_path = os.path.join(plugin_path, index.get("python_path", "python"))
+        modules = [(module["name"], module.get("entry_point", "load")) for module in index["modules"]]
+    else:
+        logger.debug("No index found for plugin %s, loading all the modules of its python folder." % plugin_path)
         plugin_python_path = os.path.join(plugin_path, "python")
-        for module_name in os.listdir(plugin_python_path):
-            sys.path.append(plugin_python_path)
-            module = __import__(module_name)
-            try:
-                module.load(plugin_path)
-            except AttributeError:
-                logger.error("Missing 'load()' method in plugin %s.  Plugin won't be loaded" % plugin_path)
+        modules = [(module_name, "load") for module_name in os.listdir(plugin_python_path)]
+
+    if plugin_python_path not in sys.path:
+        sys.path.append(plugin_python_path)
+
+    for (module_name, entry_point) in modules:
+        start = time.time()
+        module = __import__(module_name)
+        load = getattr(module, entry_point, None)
+        if load is None:
+            logger.error(
+                "Missing '%s()' method in plugin %s.  Plugin won't be loaded" % (entry_point, plugin_path)
+            )
+        else:
+            load(plugin_path)
+        record_span("plugin load: %s" % module_name, start)
+
+    logger.debug("Loaded plugin %s in %.1f ms" % (plugin_path, (time.time() - plugin_start) * 1000.0))
 
 def bootstrap_sgtk():
     """
     Bootstrap. This is called when preparing to launch by multi-launch.
     """
+    bootstrap_start = time.time()
+
+    shadow_copy = os.environ.get("SGTK_3DSMAX_SHADOW_COPY")
+    if shadow_copy:
+        compile_shadow_copy(shadow_copy)
     if sys.platform == "win32":
 
         # get the version id from max
@@ -104,19 +327,40 @@ def bootstrap_sgtk():
         error("Flow Production Tracking: Unknown platform - cannot setup ssl")
         return
 
+    # Start reading the file to open while toolkit bootstraps, see the
+    # launch_file_prefetch setting of the engine.
+    file_to_open = os.environ.get("SGTK_FILE_TO_OPEN")
+    prefetch = None
+    if file_to_open and os.environ.get("SGTK_3DSMAX_FILE_PREFETCH"):
+        prefetch = FilePrefetch(file_to_open)
+        prefetch.start_prefetch()
+
+    # See the launch_file_open_order setting of the engine.
+    open_before_engine = os.environ.get("SGTK_3DSMAX_FILE_OPEN_ORDER") == "before_engine"
+    if file_to_open and open_before_engine:
+        open_file(file_to_open, prefetch)
+
+    start = time.time()
     if os.environ.get("SGTK_LOAD_MAX_PLUGINS"):
         bootstrap_sgtk_with_plugins()
     else:
         bootstrap_sgtk_classic()
+    print "Flow Production Tracking: Bootstrapped toolkit in %.1f s" % (time.time() - start)
 
     # if a file was specified, load it now
-    file_to_open = os.environ.get("SGTK_FILE_TO_OPEN")
-    if file_to_open:
-        MaxPlus.FileManager.Open(file_to_open)
+    if file_to_open and not open_before_engine:
+        open_file(file_to_open, prefetch)
+
+    # The engine picks the spans up, and clears them, once it is idle.
+    record_span("bootstrap.py", bootstrap_start)
 
     # clean up temp env vars
+    # SGTK_3DSMAX_SHADOW_COPY is kept, the engine imports its package from
+    # there, including when it starts after this script is done.
     for var in ["TANK_ENGINE", "TANK_CONTEXT", "SGTK_FILE_TO_OPEN",
-                "SGTK_LOAD_MAX_PLUGINS"]:
+                "SGTK_LOAD_MAX_PLUGINS",
+                "SGTK_3DSMAX_FILE_PREFETCH", "SGTK_3DSMAX_FILE_OPEN_ORDER",
+                "SGTK_3DSMAX_CONTEXT_HANDOFF"]:
         if var in os.environ:
             del os.environ[var]
 
@@ -8,6 +8,73 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights 
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
-from .menu_generation import MenuGenerator
-from .maxscript import MaxScript
-from .update_engine import UpdateEngineDlg
\ No newline at end of file
+"""
+The members of this package are imported the first time they are accessed,
+so that importing the package from pre_app_init stays cheap. In particular,
+the update dialog, the shotgunutils framework and the generated UI modules
+are only loaded when the dialog is needed.
+"""
+import importlib
+import sys
+import types
+
+# Module each public member is defined in, relative to this package.
+_LAZY_MEMBERS = {
+    "MenuGenerator": ".menu_generation",
+    "MaxScript": ".maxscript",
+    "BridgeStats": ".maxscript",
+    "UpdateEngineDlg": ".update_engine",
+    "LazyAppManager": ".lazy_apps",
+    "CommandUsage": ".command_usage",
+    "CommandPrewarmer": ".command_usage",
+    "MainThreadScheduler": ".scheduler",
+    "ScheduledTask": ".scheduler",
+    "WorkerPool": ".worker_pool",
+    "Future": ".worker_pool",
+    "is_worker_thread": ".worker_pool",
+    "main_thread_only": ".worker_pool",
+    "StallWatchdog": ".watchdog",
+    "MemoryReport": ".memory_report",
+    "MemorySnapshot": ".memory_report",
+    "PerfJournal": ".journal",
+    "ScopeProfiler": ".profiler",
+    "StartupTrace": ".startup_trace",
+}
+
+__all__ = sorted(_LAZY_MEMBERS)
+
+
+class _LazyPackage(types.ModuleType):
+    """
+    Stand-in for this package in sys.modules, importing the module that
+    defines a member the first time that member is accessed.
+    """
+
+    def __getattr__(self, name):
+        """
+        Called for the attributes that haven't been loaded yet.
+
+        :param name: Name of the attribute.
+        :raises AttributeError: If the package has no such member.
+        """
+        module_name = _LAZY_MEMBERS.get(name)
+        if module_name is None:
+            raise AttributeError("module '%s' has no attribute '%s'" % (self.__name__, name))
+        value = getattr(importlib.import_module(module_name, self.__name__), name)
+        # Cache it, so that this isn't called again for that member.
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        """
+        :returns: The loaded attributes and the members not loaded yet.
+        """
+        return sorted(set(self.__dict__) | set(_LAZY_MEMBERS))
+
+
+_package = _LazyPackage(__name__, __doc__)
+_package.__dict__.update(dict((k, v) for (k, v) in globals().items() if k not in ("__name__", "__doc__")))
+# Python 2 clears the globals of a module once it is garbage collected, and
+# the code above still uses them, so keep the original module alive.
+_package._original_module = sys.modules[__name__]
+sys.modules[__name__] = _package
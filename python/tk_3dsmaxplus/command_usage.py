@@ -0,0 +1,251 @@
+# Copyright (c) 2020 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Command usage tracking, and prewarming of the most used commands
+"""
+import importlib
+import json
+import os
+import sys
+import time
+import traceback
+
+from sgtk.util.filesystem import ensure_folder_exists
+
+from .scheduler import MainThreadScheduler
+
+# Name of the file, in the engine cache location, that holds the usage counts.
+USAGE_FILE_NAME = "command_usage.json"
+
+
+class CommandUsage(object):
+    """
+    Keeps count of how many times each command was run, across sessions.
+
+    The counts are saved while Max is idle, or by :meth:`flush`, rather than
+    each time a command is run.
+    """
+
+    def __init__(self, engine):
+        """
+        Initialize Command Usage.
+        :param engine: Engine the commands are run from.
+        """
+        self._engine = engine
+        self._path = os.path.join(engine.cache_location, USAGE_FILE_NAME)
+        self._counts = self._read()
+        # Commands already run in this session.
+        self._session_runs = set()
+        # Instance names of the apps prewarmed in this session.
+        self.prewarmed_apps = set()
+        # True while there are counts to save, see flush.
+        self._dirty = False
+
+    def most_used(self, count):
+        """
+        :param count: Maximum number of command names to return.
+        :returns: List of the most used command names, most used first.
+        """
+        names = sorted(self._counts, key=lambda name: self._counts[name], reverse=True)
+        return names[:count]
+
+    def record_run(self, command_name, app_instance_name, duration):
+        """
+        Counts a run of a command, and reports how long it took if it is the
+        first run of that command in this session.
+
+        :param command_name: Name of the command that was run.
+        :param app_instance_name: Instance name of the app the command belongs to, or None.
+        :param duration: Time the command took to run, in seconds.
+        """
+        self._counts[command_name] = self._counts.get(command_name, 0) + 1
+        if not self._dirty:
+            self._dirty = True
+            self._engine.schedule_idle_task(self.flush, MainThreadScheduler.PRIORITY_LOW, name="save command usage")
+
+        if command_name in self._session_runs:
+            return
+        self._session_runs.add(command_name)
+        self._engine.log_debug(
+            "First run of '%s' took %.0f ms (prewarmed: %s)." % (
+                command_name, duration * 1000.0, app_instance_name in self.prewarmed_apps
+            )
+        )
+
+    def flush(self):
+        """
+        Saves the usage counts, if they changed since they were last saved.
+        """
+        if not self._dirty:
+            return
+        self._dirty = False
+        self._write()
+
+    def _read(self):
+        """
+        :returns: The usage counts saved by previous sessions, keyed by command name.
+        """
+        if not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path, "r") as usage_fh:
+                return json.load(usage_fh)
+        except Exception as e:
+            self._engine.log_warning("Could not read the command usage file '%s': %s" % (self._path, e))
+            return {}
+
+    def _write(self):
+        """
+        Saves the usage counts.
+        """
+        try:
+            ensure_folder_exists(os.path.dirname(self._path))
+            with open(self._path, "w") as usage_fh:
+                json.dump(self._counts, usage_fh)
+        except Exception as e:
+            self._engine.log_warning("Could not save the command usage file '%s': %s" % (self._path, e))
+
+
+class CommandPrewarmer(object):
+    """
+    Imports the python modules of the apps behind the most used commands
+    while Max is idle, so that running them the first time is faster.
+
+    The work is split in small steps, one module import each, run as low
+    priority idle tasks, and stops once the time budget has been spent.
+    """
+
+    def __init__(self, engine, usage, command_count, time_budget):
+        """
+        Initialize Command Prewarmer.
+        :param engine: Engine the commands are run from.
+        :param usage: :class:`CommandUsage` instance.
+        :param command_count: Number of commands to prewarm.
+        :param time_budget: Maximum time to spend prewarming, in milliseconds.
+        """
+        self._engine = engine
+        self._usage = usage
+        self._command_count = command_count
+        self._time_budget = time_budget / 1000.0
+        self._time_spent = 0.0
+        self._steps = []
+        self._cancelled = False
+
+    def start(self):
+        """
+        Starts prewarming.
+        """
+        for app_instance_name in self._get_app_instance_names():
+            self._steps.append((self._prewarm_app, app_instance_name))
+        if self._steps:
+            self._schedule_step()
+
+    def cancel(self):
+        """
+        Stops prewarming.
+        """
+        self._cancelled = True
+
+    def _get_app_instance_names(self):
+        """
+        :returns: Instance names of the apps behind the most used commands, without duplicates.
+        """
+        names = []
+        for command_name in self._usage.most_used(self._command_count):
+            command = self._engine.commands.get(command_name)
+            if command is None:
+                continue
+            properties = command["properties"]
+            if "app" in properties:
+                name = properties["app"].instance_name
+            else:
+                name = properties.get("lazy_app_instance")
+            if name and name not in names:
+                names.append(name)
+        return names
+
+    def _schedule_step(self):
+        """
+        Schedules the next prewarming step.
+        """
+        self._engine.schedule_idle_task(
+            self._run_step, MainThreadScheduler.PRIORITY_LOW, estimated_cost=20, name="prewarm"
+        )
+
+    def _run_step(self):
+        """
+        Runs the next prewarming step and schedules the following one.
+        """
+        if self._cancelled or not self._steps:
+            return
+
+        (step, arg) = self._steps.pop(0)
+        start = time.time()
+        try:
+            step(arg)
+        except Exception:
+            self._engine.log_debug("Prewarming step failed: %s" % traceback.format_exc())
+        self._time_spent += time.time() - start
+
+        if self._time_spent > self._time_budget:
+            self._engine.log_debug(
+                "Prewarming stopped after %.0f ms, %d step(s) skipped." % (self._time_spent * 1000.0, len(self._steps))
+            )
+        elif self._steps:
+            self._schedule_step()
+        else:
+            self._engine.log_debug("Prewarming done in %.0f ms." % (self._time_spent * 1000.0))
+
+    def _prewarm_app(self, app_instance_name):
+        """
+        Queues the imports of the modules of an app and its frameworks.
+
+        Lazy apps that are not initialized yet get initialized instead.
+        :param app_instance_name: Instance name of the app to prewarm.
+        """
+        app = self._engine.apps.get(app_instance_name)
+        if app is None:
+            app = self._engine.initialize_lazy_app(app_instance_name)
+        if app is None:
+            return
+
+        self._usage.prewarmed_apps.add(app_instance_name)
+        bundles = [app] + list(app.frameworks.values())
+        for bundle in bundles:
+            for module_name in self._get_unloaded_modules(bundle):
+                self._steps.append((importlib.import_module, module_name))
+
+    def _get_unloaded_modules(self, bundle):
+        """
+        Lists the modules of a bundle that haven't been imported yet.
+
+        Only the direct children of the bundle packages that are already
+        imported are considered.
+        :param bundle: App or framework to list the modules of.
+        :returns: List of fully qualified module names.
+        """
+        python_folder = os.path.normcase(os.path.join(bundle.disk_location, "python"))
+        module_names = []
+        for (name, module) in sys.modules.items():
+            package_file = getattr(module, "__file__", None)
+            if not package_file or os.path.basename(package_file).split(".")[0] != "__init__":
+                continue
+            package_folder = os.path.dirname(package_file)
+            if os.path.normcase(os.path.dirname(package_folder)) != python_folder:
+                continue
+            for entry in os.listdir(package_folder):
+                (child, ext) = os.path.splitext(entry)
+                is_package = os.path.isfile(os.path.join(package_folder, entry, "__init__.py"))
+                if (ext == ".py" and child != "__init__") or is_package:
+                    child_name = "%s.%s" % (name, child)
+                    if child_name not in sys.modules and child_name not in module_names:
+                        module_names.append(child_name)
+        return module_names
@@ -0,0 +1,122 @@
+# Copyright (c) 2020 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Per-session performance journal, see developer/analyze_perf_journals.py
+"""
+import glob
+import json
+import os
+import socket
+import time
+
+from sgtk.platform.qt import QtCore
+from sgtk.util.filesystem import ensure_folder_exists
+
+# Journal file names are prefixed with this, followed by the session start
+# time and process id.
+JOURNAL_PREFIX = "tk-3dsmaxplus-perf-"
+JOURNAL_EXTENSION = ".jsonl"
+
+# Time to wait after an event is recorded before writing the pending events
+# to disk, in milliseconds.
+FLUSH_DELAY = 2000
+
+
+class PerfJournal(object):
+    """
+    Writes the performance events of a session to a JSON Lines file, one
+    event per line.
+
+    The first event of a journal is a "session" event describing the
+    session. Every other event has an "event" name, a "t" time relative to
+    the start of the session and, usually, a "duration", both in
+    milliseconds. Events are buffered and written to disk in batches, see
+    flush.
+
+    Only the most recent journals are kept, older ones are deleted when a
+    new journal is opened.
+    """
+
+    def __init__(self, engine, folder, max_files):
+        """
+        Initialize Perf Journal.
+        :param engine: Engine the session is run by.
+        :param folder: Folder to write the journals to.
+        :param max_files: Number of journals to keep in the folder, this one included.
+        """
+        self._engine = engine
+        self._start = time.time()
+        self._pending = []
+        self._flush_scheduled = False
+        self.path = os.path.join(
+            folder,
+            "%s%s-%d%s" % (JOURNAL_PREFIX, time.strftime("%Y%m%d-%H%M%S", time.localtime(self._start)),
+                           os.getpid(), JOURNAL_EXTENSION)
+        )
+
+        ensure_folder_exists(folder)
+        self._rotate(folder, max_files)
+
+    def record(self, event, **fields):
+        """
+        Adds an event to the journal.
+
+        :param str event: Name of the event.
+        :param fields: Values to store with the event. They must be JSON serializable.
+        """
+        fields["event"] = event
+        fields["t"] = round((time.time() - self._start) * 1000.0, 1)
+        self._pending.append(fields)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            # Not an idle task, as those are journaled too.
+            QtCore.QTimer.singleShot(FLUSH_DELAY, self.flush)
+
+    def record_session(self, **fields):
+        """
+        Adds the "session" event, with the machine name and process id.
+
+        :param fields: Other values describing the session, like the Max version.
+        """
+        fields["machine"] = socket.gethostname()
+        fields["pid"] = os.getpid()
+        fields["start"] = self._start
+        self.record("session", **fields)
+
+    def flush(self):
+        """
+        Writes the pending events to disk.
+        """
+        self._flush_scheduled = False
+        if not self._pending:
+            return
+        lines = [json.dumps(fields, separators=(",", ":"), sort_keys=True) for fields in self._pending]
+        self._pending = []
+        try:
+            with open(self.path, "a") as journal_fh:
+                journal_fh.write("\n".join(lines) + "\n")
+        except Exception as e:
+            self._engine.log_warning("Could not write to the performance journal '%s': %s" % (self.path, e))
+
+    def _rotate(self, folder, max_files):
+        """
+        Deletes the oldest journals of a folder so that at most max_files
+        remain once this one is written.
+
+        :param folder: Folder holding the journals.
+        :param max_files: Number of journals to keep, this one included.
+        """
+        journals = sorted(glob.glob(os.path.join(folder, JOURNAL_PREFIX + "*" + JOURNAL_EXTENSION)))
+        for path in journals[:max(0, len(journals) - max_files + 1)]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                self._engine.log_debug("Could not delete the old performance journal '%s': %s" % (path, e))
@@ -0,0 +1,322 @@
+# Copyright (c) 2020 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Deferred initialization of the apps listed in the engine's 'lazy_apps' setting
+"""
+import functools
+import json
+import os
+import traceback
+
+import sgtk
+from sgtk.platform import validation
+from sgtk.util.filesystem import ensure_folder_exists
+
+# Name of the file, in the engine cache location, that holds the commands
+# registered by each lazy app the last time it was initialized.
+MANIFEST_FILE_NAME = "lazy_app_commands.json"
+
+# Command properties that are kept in the manifest. Everything else, like the
+# "app" property, can't be serialized or doesn't make sense across sessions.
+MANIFEST_PROPERTIES = ("type", "short_name", "title", "description", "tooltip", "icon")
+
+
+class LazyAppManager(object):
+    """
+    Registers stand-in commands for lazy apps and initializes those apps the
+    first time one of their commands is run.
+
+    The stand-in commands are read from a manifest of the commands each app
+    registered the last time it was initialized. An app that has no entry
+    in the manifest yet, or whose version changed since, is initialized right
+    away so that its commands can be recorded.
+
+    The apps go through the same steps as the apps core initializes: their
+    settings are validated, their frameworks set up and they are told once
+    the engine is initialized. They are destroyed along with their frameworks.
+
+    The stand-in commands of an app are removed right before it initializes,
+    so that the commands it registers get the names of the stand-ins rather
+    than names prefixed with the app instance name. The commands of an app
+    are removed when it is destroyed.
+    """
+
+    def __init__(self, engine):
+        """
+        Initialize Lazy App Manager.
+        :param engine: Engine the lazy apps are running in.
+        """
+        self._engine = engine
+        self._manifest_path = os.path.join(engine.cache_location, MANIFEST_FILE_NAME)
+        self._manifest = self._read_manifest()
+
+        # Apps initialized so far, keyed by app instance name.
+        self._apps = {}
+        # App being initialized, see current_app.
+        self._current_app = None
+
+    @property
+    def apps(self):
+        """
+        Dictionary of the lazy apps initialized so far, keyed by app instance name.
+        """
+        return self._apps
+
+    @property
+    def current_app(self):
+        """
+        The lazy app currently being initialized, or None.
+        """
+        return self._current_app
+
+    def register_commands(self, engine_starting=False):
+        """
+        Registers a stand-in command for each command of the lazy apps that
+        aren't initialized yet.
+
+        :param engine_starting: True when called while the engine is starting.
+        """
+        for (app_instance_name, app_config) in self._get_app_configs().items():
+            if app_instance_name in self._apps:
+                continue
+
+            app_manifest = self._manifest.get(app_instance_name)
+            if app_manifest is None or app_manifest["location"] != self._get_location_uri(app_config):
+                self._engine.log_debug(
+                    "No cached commands for lazy app '%s', initializing it now." % app_instance_name
+                )
+                self.initialize_app(app_instance_name, engine_starting)
+                continue
+
+            for command in app_manifest["commands"]:
+                properties = dict(command["properties"])
+                properties["lazy_app_instance"] = app_instance_name
+                properties["lazy_app_name"] = app_manifest["display_name"]
+                self._engine.register_command(
+                    command["name"],
+                    functools.partial(self._run_command, app_instance_name, command["name"]),
+                    properties
+                )
+
+    def initialize_app(self, app_instance_name, engine_starting=False):
+        """
+        Initializes a lazy app, replacing its stand-in commands with the
+        commands it registers.
+
+        :param app_instance_name: Instance name of the app to initialize.
+        :param engine_starting: True when called while the engine is starting,
+            in which case the app is told the engine is initialized once it is.
+        :returns: The app instance, or None if it failed to initialize.
+        """
+        if app_instance_name in self._apps:
+            return self._apps[app_instance_name]
+
+        app_config = self._get_app_configs().get(app_instance_name)
+        if app_config is None:
+            self._engine.log_error("'%s' is not listed in the 'lazy_apps' setting." % app_instance_name)
+            return None
+
+        engine = self._engine
+        settings = dict((k, v) for (k, v) in app_config.items() if k != "location")
+        try:
+            descriptor = engine.sgtk.pipeline_configuration.get_app_descriptor(app_config["location"])
+            descriptor.ensure_local()
+            env = engine.sgtk.pipeline_configuration.get_environment(engine.environment["name"], engine.context)
+
+            # Same checks as core does for the apps of the environment.
+            validation.validate_context(descriptor, engine.context)
+            validation.validate_platform(descriptor)
+            validation.validate_settings(
+                app_instance_name, engine.sgtk, engine.context, descriptor.configuration_schema, settings
+            )
+
+            app = sgtk.platform.application.get_application(
+                engine, descriptor.get_path(), descriptor, settings, app_instance_name, env
+            )
+            sgtk.platform.framework.setup_frameworks(engine, app, env, descriptor)
+
+            stand_ins = self._remove_commands(
+                lambda properties: properties.get("lazy_app_instance") == app_instance_name
+            )
+            self._current_app = app
+            try:
+                app.init_app()
+            except Exception:
+                # Drop whatever the app registered, and put its stand-ins back.
+                self._remove_commands(lambda properties: properties.get("app") is app)
+                engine.commands.update(stand_ins)
+                raise
+            finally:
+                self._current_app = None
+        except Exception:
+            engine.log_error("Failed to initialize lazy app '%s': %s" % (app_instance_name, traceback.format_exc()))
+            return None
+
+        self._apps[app_instance_name] = app
+        self._record_commands(app_instance_name, app, app_config)
+
+        if engine_starting:
+            # Core tells its apps once the engine is done starting.
+            engine.schedule_idle_task(
+                functools.partial(self._post_engine_init, app_instance_name, app),
+                engine.tk_3dsmax.MainThreadScheduler.PRIORITY_HIGH,
+            )
+        else:
+            self._post_engine_init(app_instance_name, app)
+        return app
+
+    def _post_engine_init(self, app_instance_name, app):
+        """
+        Tells an app that the engine is initialized.
+
+        :param app_instance_name: Instance name of the app.
+        :param app: The app instance.
+        """
+        if self._apps.get(app_instance_name) is not app:
+            # Destroyed in the meantime.
+            return
+        try:
+            app.post_engine_init()
+        except Exception:
+            self._engine.log_error(
+                "Failed to run post_engine_init for lazy app '%s': %s" % (app_instance_name, traceback.format_exc())
+            )
+
+    def destroy_apps(self):
+        """
+        Destroys the lazy apps initialized so far, and their frameworks, in
+        the same order as core does for its apps.
+        """
+        for (app_instance_name, app) in self._apps.items():
+            try:
+                app._destroy_frameworks()
+                app.destroy_app()
+            except Exception:
+                self._engine.log_error(
+                    "Failed to destroy lazy app '%s': %s" % (app_instance_name, traceback.format_exc())
+                )
+            # The commands hold on to the app through their callback and properties.
+            self._remove_commands(lambda properties: properties.get("app") is app)
+        self._apps = {}
+
+    def _remove_commands(self, predicate):
+        """
+        Removes the commands whose properties match a predicate from the engine.
+
+        :param predicate: Callable taking the properties of a command.
+        :returns: Dictionary of the removed commands, keyed by name.
+        """
+        removed = {}
+        for (command_name, command) in list(self._engine.commands.items()):
+            if predicate(command["properties"]):
+                removed[command_name] = self._engine.commands.pop(command_name)
+        return removed
+
+    def _run_command(self, app_instance_name, command_name):
+        """
+        Callback of the stand-in commands. Initializes the app if needed and
+        runs its actual command.
+
+        :param app_instance_name: Instance name of the app the command belongs to.
+        :param command_name: Name of the command to run.
+        """
+        app = self.initialize_app(app_instance_name)
+        if app is None:
+            return
+
+        command = self._find_command(app, command_name)
+        if command is None:
+            self._engine.log_error(
+                "Lazy app '%s' didn't register a '%s' command." % (app_instance_name, command_name)
+            )
+            return
+
+        # Replace the stand-in commands in the menu with the real ones.
+        self._engine.update_shotgun_menu()
+        command["callback"]()
+
+    def _find_command(self, app, command_name):
+        """
+        Looks up a command registered by an app.
+
+        Core prefixes the name of a command with the app instance name when
+        another command already has that name, so the prefixed name is
+        looked up too.
+
+        :param app: The app instance.
+        :param command_name: Name the command was registered with by the app.
+        :returns: The command, or None if the app didn't register it.
+        """
+        for (name, command) in self._engine.commands.items():
+            if command["properties"].get("app") is not app:
+                continue
+            if name in (command_name, "%s:%s" % (app.instance_name, command_name)):
+                return command
+        return None
+
+    def _record_commands(self, app_instance_name, app, app_config):
+        """
+        Saves the commands registered by a lazy app to the manifest.
+
+        :param app_instance_name: Instance name of the app.
+        :param app: The app instance.
+        :param app_config: The app's entry in the 'lazy_apps' setting.
+        """
+        commands = []
+        for (command_name, command) in self._engine.commands.items():
+            if command["properties"].get("app") is not app:
+                continue
+            properties = dict(
+                (key, command["properties"][key]) for key in MANIFEST_PROPERTIES if key in command["properties"]
+            )
+            commands.append({"name": command_name, "properties": properties})
+
+        self._manifest[app_instance_name] = {
+            "location": self._get_location_uri(app_config),
+            "display_name": app.display_name,
+            "commands": commands,
+        }
+
+        try:
+            ensure_folder_exists(os.path.dirname(self._manifest_path))
+            with open(self._manifest_path, "w") as manifest_fh:
+                json.dump(self._manifest, manifest_fh, indent=2)
+        except Exception as e:
+            self._engine.log_warning("Could not save the lazy app manifest '%s': %s" % (self._manifest_path, e))
+
+    def _read_manifest(self):
+        """
+        Reads the manifest saved by previous sessions.
+
+        :returns: Dictionary keyed by app instance name.
+        """
+        if not os.path.exists(self._manifest_path):
+            return {}
+        try:
+            with open(self._manifest_path, "r") as manifest_fh:
+                return json.load(manifest_fh)
+        except Exception as e:
+            self._engine.log_warning("Could not read the lazy app manifest '%s': %s" % (self._manifest_path, e))
+            return {}
+
+    def _get_app_configs(self):
+        """
+        :returns: The 'lazy_apps' setting of the engine.
+        """
+        return self._engine.get_setting("lazy_apps", {}) or {}
+
+    @staticmethod
+    def _get_location_uri(app_config):
+        """
+        :param app_config: An entry of the 'lazy_apps' setting.
+        :returns: The location of the app as a descriptor uri.
+        """
+        return sgtk.descriptor.descriptor_dict_to_uri(app_config["location"])
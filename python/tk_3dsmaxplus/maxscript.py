@@ -12,14 +12,122 @@
 MaxScript handling for 3ds Max
 """
 import hashlib
+import os
+import sys
+import time
 import MaxPlus
 
+from .worker_pool import main_thread_only
+
+# Modules whose frames are skipped when looking for the code that asked for
+# an evaluation: this one, and the one of the main_thread_only wrapper.
+_BRIDGE_MODULES = (__name__, main_thread_only.__module__)
+
+
+class BridgeStats(object):
+    """
+    Counters of the MaxScript evaluations made through :meth:`MaxScript.evaluate`.
+    """
+
+    def __init__(self):
+        """
+        Initialize Bridge Stats.
+        """
+        self.reset()
+
+    def reset(self):
+        """
+        Clears all the counters.
+        """
+        # Counters keyed by call site, see record.
+        self._sites = {}
+
+    def record(self, site, duration, size):
+        """
+        Counts an evaluation.
+
+        :param site: "file:line (function)" string of the code that asked for the evaluation.
+        :param duration: Time the evaluation took, in seconds.
+        :param size: Size of the evaluated script, in bytes.
+        """
+        counters = self._sites.get(site)
+        if counters is None:
+            counters = self._sites[site] = {"calls": 0, "total_time": 0.0, "max_time": 0.0, "bytes": 0}
+        counters["calls"] += 1
+        counters["total_time"] += duration
+        counters["max_time"] = max(counters["max_time"], duration)
+        counters["bytes"] += size
+
+    def summary(self):
+        """
+        :returns: Dictionary with the "calls", "total_time", "max_time" and "bytes"
+            totals, and the same counters per call site under "sites". Times are
+            in seconds.
+        """
+        summary = {"calls": 0, "total_time": 0.0, "max_time": 0.0, "bytes": 0}
+        for counters in self._sites.values():
+            summary["calls"] += counters["calls"]
+            summary["total_time"] += counters["total_time"]
+            summary["max_time"] = max(summary["max_time"], counters["max_time"])
+            summary["bytes"] += counters["bytes"]
+        summary["sites"] = dict((site, dict(counters)) for (site, counters) in self._sites.items())
+        return summary
+
+
 class MaxScript:
     """
     MaxScript/Python Bridge Utilities
     """
 
+    # Counters of all the evaluations, see evaluate.
+    stats = BridgeStats()
+
+    # Callable logging each evaluation when tracing is on, see set_tracing.
+    _trace_callback = None
+
     @staticmethod
+    def set_tracing(log_callback):
+        """
+        Turns the logging of every MaxScript evaluation on or off.
+
+        :param log_callback: Callable taking a message, or None to turn tracing off.
+        """
+        MaxScript._trace_callback = log_callback
+
+    @staticmethod
+    @main_thread_only
+    def evaluate(script):
+        """
+        Evaluates MaxScript code, counting the call, its duration and the size
+        of the script against the code that asked for it.
+
+        All the MaxScript evaluations should go through this method.
+        :param script: MaxScript code to evaluate.
+        :returns: The value returned by MaxPlus.Core.EvalMAXScript.
+        """
+        # Find the first caller outside of this module and of the
+        # main_thread_only wrappers.
+        frame = sys._getframe(1)
+        while frame.f_back is not None and frame.f_globals.get("__name__") in _BRIDGE_MODULES:
+            frame = frame.f_back
+        site = "%s:%d (%s)" % (os.path.basename(frame.f_code.co_filename), frame.f_lineno, frame.f_code.co_name)
+        frame = None
+
+        start = time.time()
+        try:
+            return MaxPlus.Core.EvalMAXScript(script)
+        finally:
+            duration = time.time() - start
+            MaxScript.stats.record(site, duration, len(script))
+            if MaxScript._trace_callback is not None:
+                MaxScript._trace_callback(
+                    "MaxScript evaluation from %s took %.1f ms (%d bytes): %s" % (
+                        site, duration * 1000.0, len(script), script.strip().split("\n")[0]
+                    )
+                )
+
+    @staticmethod
+    @main_thread_only
     def add_to_menu(from_menu_var, to_menu_var, from_menu_name):
         """
         Add given menu to another menu
@@ -28,12 +136,13 @@ class MaxScript:
         :param from_menu_name: Name of menu item to give to MaxScript
         """
 
-        MaxPlus.Core.EvalMAXScript('''
+        MaxScript.evaluate('''
             sgtk_menu_sub_item = menuMan.createSubMenuItem "{from_menu_name}" {from_menu_var}
             {to_menu_var}.addItem sgtk_menu_sub_item -1
         '''.format(from_menu_var=from_menu_var, to_menu_var=to_menu_var, from_menu_name=from_menu_name))
 
     @staticmethod
+    @main_thread_only
     def create_menu(menu_name, menu_var):
         """
         Create a menu
@@ -42,13 +151,13 @@ class MaxScript:
         """
 
         # Remove old Shotgun menu entry from cache
-        MaxPlus.Core.EvalMAXScript('''
+        MaxScript.evaluate('''
             -- clear the old menu
             sgtk_oldMenu = menuMan.findMenu "{menu_name}"
             if sgtk_oldMenu != undefined then menuMan.unregisterMenu sgtk_oldMenu
         '''.format(menu_name="Shotgun"))
 
-        MaxPlus.Core.EvalMAXScript('''
+        MaxScript.evaluate('''
             -- clear the old menu
             sgtk_oldMenu = menuMan.findMenu "{menu_name}"
             if sgtk_oldMenu != undefined then menuMan.unregisterMenu sgtk_oldMenu
@@ -58,18 +167,20 @@ class MaxScript:
         '''.format(menu_var=menu_var, menu_name=menu_name))
 
     @staticmethod
+    @main_thread_only
     def add_separator(menu_var):
         """
         Add separator to a menu
         :param menu_var: MaxScript variable name of the menu to add separator into
         """
 
-        MaxPlus.Core.EvalMAXScript('''
+        MaxScript.evaluate('''
             sgtk_menu_separator = menuMan.createSeparatorItem()
             {menu_var}.addItem sgtk_menu_separator -1
         '''.format(menu_var=menu_var))
 
     @staticmethod
+    @main_thread_only
     def add_to_main_menu_bar(menu_var, menu_name):
         """
         Add menu to 3ds max's main menu bar
@@ -77,7 +188,7 @@ class MaxScript:
         :param menu_name: String name of the menu to add
         """
 
-        MaxPlus.Core.EvalMAXScript('''
+        MaxScript.evaluate('''
             -- Add main menu to Max, second to last which should be before Help
             sgtk_main_menu_bar = menuMan.getMainMenuBar()
             sgtk_sub_menu_index = sgtk_main_menu_bar.numItems() - 1
@@ -87,13 +198,15 @@ class MaxScript:
         '''.format(menu_var=menu_var, menu_name=menu_name))
 
     @staticmethod
-    def add_action_to_menu(callback, action_name, menu_var, engine):
+    @main_thread_only
+    def add_action_to_menu(callback, action_name, menu_var, engine, position=-1):
         """
         Add a menu item for this command to the given MaxScript menu variable name.
         :param callback: Callback function to call with this action
         :param action_name: Name of the action, as will appear to the user
         :param menu_var: MaxScript menu variable name to add menu item to.
         :param engine: Current engine where the action can be globally linked back to.
+        :param position: 1-based position of the item in the menu, -1 to add it at the end.
         """
         obj = callback.im_self
         method_name = callback.__name__
@@ -143,7 +256,7 @@ class MaxScript:
             "    engine.log_error('Flow Production Tracking Error: Failed to find Action command in MAXScript callback for action [{action_name}]!')\n"
         ).format(hash_name=hash_name, command_name=method_name, action_name=action_name)
 
-        MaxPlus.Core.EvalMAXScript('''
+        MaxScript.evaluate('''
             -- Create MacroScript that will callback to our python object
             macroScript {macro_name}
             category: "Flow Production Tracking Menu Actions"
@@ -169,10 +282,34 @@ class MaxScript:
             sgtk_menu_action = menuMan.createActionItem "{macro_name}" "Flow Production Tracking Menu Actions"
             sgtk_menu_action.setUseCustomTitle true
             sgtk_menu_action.setTitle("{action_name}")
-            {menu_var}.addItem sgtk_menu_action -1
-        '''.format(macro_name=macro_name, menu_var=menu_var, action_name=action_name, python_code=python_code))
+            {menu_var}.addItem sgtk_menu_action {position}
+        '''.format(macro_name=macro_name, menu_var=menu_var, action_name=action_name, python_code=python_code,
+                   position=position))
+
+    @staticmethod
+    @main_thread_only
+    def remove_from_menu(menu_var, position):
+        """
+        Remove an item from a menu
+        :param menu_var: MaxScript variable name of the menu to remove the item from
+        :param position: 1-based position of the item to remove
+        """
+
+        MaxScript.evaluate('''
+            {menu_var}.removeItemByPosition {position}
+        '''.format(menu_var=menu_var, position=position))
+
+    @staticmethod
+    @main_thread_only
+    def update_menu_bar():
+        """
+        Redraw 3ds max's main menu bar so that changes made to its menus are visible
+        """
+
+        MaxScript.evaluate("menuMan.updateMenuBar()")
 
     @staticmethod
+    @main_thread_only
     def disable_menu():
         """
         Sets a flag so that menu actions will not be called, which would throw exceptions. See add_action_menu's macroscript
@@ -180,12 +317,13 @@ class MaxScript:
 
         This is used to disable actions while a modal window is opened.
         """
-        MaxPlus.Core.EvalMAXScript("sgtk_main_menu_enabled = False")
+        MaxScript.evaluate("sgtk_main_menu_enabled = False")
 
     @staticmethod
+    @main_thread_only
     def enable_menu():
         """
         Sets a flag so that menu actions can be called.
         """
 
-        MaxPlus.Core.EvalMAXScript("sgtk_main_menu_enabled = True")
+        MaxScript.evaluate("sgtk_main_menu_enabled = True")
@@ -0,0 +1,162 @@
+# Copyright (c) 2020 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Reporting of the memory held by the engine
+"""
+import gc
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # Not available before Python 3.4.
+    tracemalloc = None
+
+# How deep to follow references when approximating the size of an object.
+MAX_SIZE_DEPTH = 4
+
+# Number of entries listed in the differences between two snapshots.
+MAX_DIFF_ENTRIES = 20
+
+
+class MemorySnapshot(object):
+    """
+    State of the memory held by the engine at a point in time.
+    """
+
+    def __init__(self, categories, object_counts, allocations):
+        """
+        Initialize Memory Snapshot.
+        :param categories: Dictionary of (object count, approximate size in bytes)
+            tuples keyed by category name.
+        :param object_counts: Dictionary of the number of live objects tracked
+            by the garbage collector, keyed by type name.
+        :param allocations: tracemalloc snapshot, or None if tracemalloc isn't tracing.
+        """
+        self.time = time.time()
+        self.categories = categories
+        self.object_counts = object_counts
+        self.allocations = allocations
+
+
+class MemoryReport(object):
+    """
+    Measures the objects the engine holds on to, to spot the ones that keep
+    growing over a session, e.g. across context switches.
+    """
+
+    def __init__(self, engine):
+        """
+        Initialize Memory Report.
+        :param engine: Engine to report on.
+        """
+        self._engine = engine
+
+    def take_snapshot(self):
+        """
+        Measures the engine held objects.
+
+        :returns: :class:`MemorySnapshot` instance.
+        """
+        engine = self._engine
+        categories = {}
+        for (name, objects) in [
+            ("maxscript_objects", getattr(engine, "maxscript_objects", {})),
+            ("created_qt_dialogs", engine.created_qt_dialogs),
+            ("dock_widgets", engine._dock_widgets),
+            ("safe_dialogs", engine._safe_dialog),
+            ("templates", engine.sgtk.templates),
+            ("apps", engine.apps),
+            ("commands", engine.commands),
+        ]:
+            categories[name] = (len(objects), self._get_size(objects, set(), 0))
+
+        object_counts = {}
+        for obj in gc.get_objects():
+            type_name = type(obj).__name__
+            object_counts[type_name] = object_counts.get(type_name, 0) + 1
+
+        allocations = None
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            allocations = tracemalloc.take_snapshot()
+
+        return MemorySnapshot(categories, object_counts, allocations)
+
+    def format(self, snapshot, previous=None):
+        """
+        Formats a snapshot as text.
+
+        :param snapshot: :class:`MemorySnapshot` to format.
+        :param previous: Earlier :class:`MemorySnapshot` to list the differences from, or None.
+        :returns: The report, as a string.
+        """
+        lines = ["Toolkit memory report", ""]
+        lines.append("%-20s %10s %14s" % ("Category", "Objects", "Approx. size"))
+        for name in sorted(snapshot.categories):
+            (count, size) = snapshot.categories[name]
+            line = "%-20s %10d %11.1f KB" % (name, count, size / 1024.0)
+            if previous is not None and name in previous.categories:
+                (previous_count, previous_size) = previous.categories[name]
+                line += "  (%+d objects, %+.1f KB)" % (count - previous_count, (size - previous_size) / 1024.0)
+            lines.append(line)
+
+        if previous is None:
+            return "\n".join(lines)
+
+        lines.append("")
+        lines.append("Changes over the last %.0f seconds:" % (snapshot.time - previous.time))
+        if snapshot.allocations is not None and previous.allocations is not None:
+            for stat in snapshot.allocations.compare_to(previous.allocations, "lineno")[:MAX_DIFF_ENTRIES]:
+                lines.append("  %s" % stat)
+        else:
+            diffs = []
+            for (type_name, count) in snapshot.object_counts.items():
+                diff = count - previous.object_counts.get(type_name, 0)
+                if diff:
+                    diffs.append((diff, type_name))
+            diffs.sort(reverse=True)
+            for (diff, type_name) in diffs[:MAX_DIFF_ENTRIES]:
+                lines.append("  %+8d %s objects" % (diff, type_name))
+        return "\n".join(lines)
+
+    def _get_size(self, obj, seen, depth):
+        """
+        Approximates the memory retained by an object by adding up the sizes
+        of the containers, instance dictionaries and values it references.
+
+        Objects shared with other parts of the session are counted too, and
+        memory held by C++ objects, like Qt widgets, isn't, so this is only
+        good to spot trends.
+        :param obj: Object to measure.
+        :param seen: Ids of the objects already counted.
+        :param depth: Number of references followed to get to this object.
+        :returns: Approximate size in bytes.
+        """
+        if id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+        try:
+            size = sys.getsizeof(obj)
+        except TypeError:
+            return 0
+        if depth >= MAX_SIZE_DEPTH:
+            return size
+
+        if isinstance(obj, dict):
+            for (key, value) in obj.items():
+                size += self._get_size(key, seen, depth + 1) + self._get_size(value, seen, depth + 1)
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            for item in obj:
+                size += self._get_size(item, seen, depth + 1)
+        elif hasattr(obj, "__dict__"):
+            size += self._get_size(obj.__dict__, seen, depth + 1)
+        return size
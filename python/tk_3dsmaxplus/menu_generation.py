@@ -12,16 +12,26 @@
 Menu handling for 3ds Max
 """
 import MaxPlus
+import json
 import os
 import sys
+import time
 import traceback
 import unicodedata
 
 from sgtk.platform.qt import QtCore, QtGui
+from sgtk.util.filesystem import ensure_folder_exists
 from .maxscript import MaxScript
 
 MENU_LABEL = "Flow Production Tracking"
 
+# Number of seconds to wait for the file system locations of a context before
+# giving up on the "Jump to File System" menu item.
+FILESYSTEM_LOCATIONS_TIMEOUT = 15
+
+# Position of the "Jump to File System" item in the context menu.
+JUMP_TO_FS_POSITION = 2
+
 class MenuGenerator(object):
     """
     Menu generation functionality for 3dsmax
@@ -29,7 +39,16 @@ class MenuGenerator(object):
     Actual menu creation is done through MaxScript to prevent a crash with modal dialogs.
     The crash happens if a modal dialog is open and a user clicks on a menu with action items 
     that directly call python code
+
+    The layout of the last built menu is kept as a manifest, which the basic
+    plugin uses to put up the menu at the next launch before the engine has
+    started. See :meth:`write_manifest`.
     """
+
+    # Path of the file to save the menu manifest to. Set by the launcher.
+    MANIFEST_ENV_VAR = "SGTK_3DSMAX_MENU_MANIFEST"
+    MANIFEST_VERSION = 1
+
     def __init__(self, engine):
         """
         Initialize Menu Generator.
@@ -45,6 +64,39 @@ class MenuGenerator(object):
         # Need a globally available object for maxscript action callbacks to be able to refer to python objects
         self._engine.maxscript_objects = {}
 
+        # File system locations of the contexts seen so far, keyed by context.
+        # See _get_context_key.
+        self._filesystem_locations = {}
+        # Contexts whose file system locations are being resolved.
+        self._pending_locations = set()
+        # Layout of the last built menu, see create_menu.
+        self._manifest_items = []
+
+    @property
+    def manifest(self):
+        """
+        Layout of the last built menu, as a JSON serializable dictionary.
+
+        The "items" of the menu are listed in order. Each one is either a
+        command, with its "name", "type", "app_instance" and whether it is a
+        "favourite", a "separator", or a "submenu" with a "title" and its own
+        "items".
+        """
+        return {"version": self.MANIFEST_VERSION, "items": self._manifest_items}
+
+    @staticmethod
+    def write_manifest(path, manifest):
+        """
+        Writes a menu manifest to disk. Doesn't touch MaxPlus, so it can be
+        run on a worker thread.
+
+        :param path: Path of the file to write.
+        :param manifest: Manifest, as returned by :attr:`manifest`.
+        """
+        ensure_folder_exists(os.path.dirname(path))
+        with open(path, "w") as manifest_fh:
+            json.dump(manifest, manifest_fh)
+
     def create_menu(self):
         """
         Create the Shotgun Menu
@@ -52,17 +104,21 @@ class MenuGenerator(object):
 
         # Create the main menu
         MaxScript.create_menu(MENU_LABEL, self._menu_var)
+        self._manifest_items = []
 
         # enumerate all items and create menu objects for them
         cmd_items = []
         for (cmd_name, cmd_details) in self._engine.commands.items():
-            cmd_items.append(AppCommand(cmd_name, cmd_details))
+            cmd_items.append(AppCommand(cmd_name, cmd_details, self._engine))
 
         # start with context menu
         self._create_context_builder()
+        ctx_items = []
         for cmd in cmd_items:
             if cmd.get_type() == "context_menu":
                 cmd.add_to_menu(self._ctx_var, self._engine)
+                ctx_items.append(cmd.get_manifest_item())
+        self._manifest_items.append({"submenu": True, "title": str(self._engine.context), "items": ctx_items})
 
         # now favourites
         for fav in self._engine.get_setting("menu_favourites", []):
@@ -75,8 +131,10 @@ class MenuGenerator(object):
                     cmd.add_to_menu(self._menu_var, self._engine)
                     # mark as a favourite item
                     cmd.favourite = True
+                    self._manifest_items.append(cmd.get_manifest_item())
 
         MaxScript.add_separator(self._menu_var)
+        self._manifest_items.append({"separator": True})
         
         # now go through all of the menu items.
         # separate them out into various sections
@@ -113,9 +171,19 @@ class MenuGenerator(object):
         MaxScript.create_menu(ctx_name, self._ctx_var)
         MaxScript.add_action_to_menu(self._jump_to_sg, 'Jump to Flow Production Tracking', self._ctx_var, self._engine)
 
-        # Add the menu item only when there are some file system locations.
-        if ctx.filesystem_locations:
-            MaxScript.add_action_to_menu(self._jump_to_fs, 'Jump to File System', self._ctx_var, self._engine)
+        # Retrieving the file system locations can mean path cache and Flow
+        # Production Tracking lookups, so they are resolved in the background.
+        # A placeholder is shown until they are known.
+        ctx_key = self._get_context_key(ctx)
+        if ctx_key in self._filesystem_locations:
+            # Add the menu item only when there are some file system locations.
+            if self._filesystem_locations[ctx_key]:
+                MaxScript.add_action_to_menu(self._jump_to_fs, 'Jump to File System', self._ctx_var, self._engine)
+        else:
+            MaxScript.add_action_to_menu(
+                self._resolving_fs, 'Resolving File System Locations...', self._ctx_var, self._engine
+            )
+            self._resolve_filesystem_locations(ctx, ctx_key)
 
         MaxScript.add_separator(self._menu_var)
         MaxScript.add_to_menu(self._ctx_var, self._menu_var, "ctx_builder")
@@ -127,12 +195,117 @@ class MenuGenerator(object):
         url = self._engine.context.shotgun_url
         QtGui.QDesktopServices.openUrl(QtCore.QUrl(url))
 
+    def _resolving_fs(self):
+        """
+        Placeholder action shown while the file system locations are resolved.
+        """
+        self._engine.log_info("The file system locations of the current context are still being resolved.")
+
+    @staticmethod
+    def _get_context_key(ctx):
+        """
+        Returns a hashable key identifying a context.
+        :param ctx: Context to get a key for.
+        :returns: Tuple of (entity type, entity id) tuples.
+        """
+        return tuple(
+            (entity["type"], entity["id"]) if entity else None
+            for entity in (ctx.project, ctx.entity, ctx.step, ctx.task)
+        )
+
+    def _resolve_filesystem_locations(self, ctx, ctx_key):
+        """
+        Resolves the file system locations of a context on a worker thread.
+
+        The menu is patched once they are known, see _on_filesystem_locations_resolved.
+        :param ctx: Context to resolve the file system locations of.
+        :param ctx_key: Key of the context, as returned by _get_context_key.
+        """
+        if ctx_key in self._pending_locations:
+            return
+        self._pending_locations.add(ctx_key)
+
+        # This doesn't touch MaxPlus, which makes it safe to run on a worker thread.
+        future = self._engine.submit_worker_task(lambda: ctx.filesystem_locations)
+        future.add_done_callback(lambda f: self._on_filesystem_locations_future_done(ctx, ctx_key, f))
+
+        QtCore.QTimer.singleShot(
+            FILESYSTEM_LOCATIONS_TIMEOUT * 1000,
+            lambda: self._on_filesystem_locations_timeout(ctx_key)
+        )
+
+    def _on_filesystem_locations_future_done(self, ctx, ctx_key, future):
+        """
+        Called on the main thread once the file system locations of a context
+        have been resolved.
+        :param ctx: Context the locations were resolved for.
+        :param ctx_key: Key of the context, as returned by _get_context_key.
+        :param future: Future of the worker task that resolved the locations.
+        """
+        if future.cancelled():
+            self._pending_locations.discard(ctx_key)
+            return
+        if future.exception() is not None:
+            self._engine.log_error(
+                "Failed to resolve the file system locations of %s: %s" % (ctx, future.traceback)
+            )
+            locations = []
+        else:
+            locations = future.result()
+        self._on_filesystem_locations_resolved(ctx_key, locations)
+
+    def _on_filesystem_locations_resolved(self, ctx_key, locations):
+        """
+        Caches the file system locations of a context and replaces the
+        placeholder of the context menu, if that menu is still displayed.
+        :param ctx_key: Key of the context the locations belong to.
+        :param locations: List of paths.
+        """
+        self._filesystem_locations[ctx_key] = locations
+        if ctx_key not in self._pending_locations:
+            # We timed out, the locations will be used the next time the menu is built.
+            return
+        self._pending_locations.discard(ctx_key)
+
+        if ctx_key != self._get_context_key(self._engine.context):
+            # The context changed since, so the menu has been rebuilt.
+            return
+
+        MaxScript.remove_from_menu(self._ctx_var, JUMP_TO_FS_POSITION)
+        if locations:
+            MaxScript.add_action_to_menu(
+                self._jump_to_fs, 'Jump to File System', self._ctx_var, self._engine, JUMP_TO_FS_POSITION
+            )
+        MaxScript.update_menu_bar()
+
+    def _on_filesystem_locations_timeout(self, ctx_key):
+        """
+        Gives up on waiting for the file system locations of a context.
+        :param ctx_key: Key of the context the locations are resolved for.
+        """
+        if ctx_key not in self._pending_locations:
+            return
+        self._pending_locations.discard(ctx_key)
+        self._engine.log_warning(
+            "Timed out after %d seconds while resolving the file system locations of the current context. "
+            "'Jump to File System' will be available the next time the menu is built." %
+            FILESYSTEM_LOCATIONS_TIMEOUT
+        )
+
+        if ctx_key == self._get_context_key(self._engine.context):
+            # Remove the placeholder.
+            MaxScript.remove_from_menu(self._ctx_var, JUMP_TO_FS_POSITION)
+            MaxScript.update_menu_bar()
+
     def _jump_to_fs(self):
         """
         Jump from context to Fs
         """
         # launch one window for each location on disk
-        paths = self._engine.context.filesystem_locations
+        ctx = self._engine.context
+        paths = self._filesystem_locations.get(self._get_context_key(ctx))
+        if paths is None:
+            paths = ctx.filesystem_locations
         for disk_location in paths:
             # get the setting
             system = sys.platform
@@ -164,10 +337,13 @@ class MenuGenerator(object):
                 menu_var = 'sgtk_menu_builder'
                 MaxScript.create_menu(app_name, menu_var)
                 
+                app_items = []
                 for cmd in commands_by_app[app_name]:
                     cmd.add_to_menu(menu_var, self._engine)
+                    app_items.append(cmd.get_manifest_item())
 
                 MaxScript.add_to_menu(menu_var, self._menu_var, "ShotGridMenu")
+                self._manifest_items.append({"submenu": True, "title": app_name, "items": app_items})
             else:
                 # this app only has a single entry.
                 # display that on the menu
@@ -175,22 +351,25 @@ class MenuGenerator(object):
                 if not cmd_obj.favourite:
                     # skip favourites since they are alreay on the menu
                     cmd_obj.add_to_menu(self._menu_var, self._engine)
+                    self._manifest_items.append(cmd_obj.get_manifest_item())
 
 
 class AppCommand(object):
     """
     Wraps around a single command that you get from engine.commands
     """
-    def __init__(self, name, command_dict):
+    def __init__(self, name, command_dict, engine=None):
         """
         Initialize AppCommand object.
         :param name: Command name
         :param command_dict: Dictionary containing a 'callback' property to use as callback.
+        :param engine: Engine the command is run from, used to keep track of its usage.
         """
         self.name = name
         self.properties = command_dict["properties"]
         self.callback = command_dict["callback"]
         self.favourite = False
+        self._engine = engine
 
     def get_app_name(self):
         """
@@ -198,13 +377,18 @@ class AppCommand(object):
         """
         if "app" in self.properties:
             return self.properties["app"].display_name
-        return None
+        # Stand-in command of an app that isn't initialized yet.
+        return self.properties.get("lazy_app_name")
 
     def get_app_instance_name(self):
         """
         Returns the name of the app instance, as defined in the environment.
         Returns None if not found.
         """
+        if "lazy_app_instance" in self.properties:
+            # Stand-in command of an app that isn't initialized yet.
+            return self.properties["lazy_app_instance"]
+
         engine = self.get_engine()
         if engine is None:
             return None
@@ -219,7 +403,8 @@ class AppCommand(object):
                 # found our app!
                 return app_instance_name
 
-        return None
+        # Apps initialized by the engine on demand aren't listed in its apps.
+        return app_instance.instance_name
 
     def get_documentation_url_str(self):
         """
@@ -254,12 +439,42 @@ class AppCommand(object):
         """
         return self.properties.get("type", "default")
 
+    def get_menu_label(self):
+        """
+        Returns the label of the command in the menu. Commands whose label
+        shows some state pass a callable returning it as their 'menu_label'
+        property. Defaults to the command name.
+        """
+        menu_label = self.properties.get("menu_label")
+        if menu_label is None:
+            return self.name
+        if callable(menu_label):
+            return menu_label()
+        return menu_label
+
+    def get_manifest_item(self):
+        """
+        Returns the entry of this command in the menu manifest.
+        See :attr:`MenuGenerator.manifest`.
+        """
+        return {
+            "name": self.name,
+            "type": self.get_type(),
+            "app_instance": self.get_app_instance_name(),
+            "favourite": self.favourite,
+        }
+
     def execute(self):
         """
         Delegate method for this command
         """
+        start = time.time()
         try:
-            self.callback()
+            if self._engine is not None:
+                with self._engine.perf_scope("command", self.name):
+                    self.callback()
+            else:
+                self.callback()
         except:
             tb = traceback.format_exc()
 
@@ -267,10 +482,13 @@ class AppCommand(object):
             if engine is not None:
                 engine.log_error("Failed to call command '%s'. '%s'!" % (self.name, tb))
 
+        if self._engine is not None:
+            self._engine.command_usage.record_run(self.name, self.get_app_instance_name(), time.time() - start)
+
     def add_to_menu(self, menu_var, engine):
         """
         Add command to menu
         :param menu_var: MaxScript menu variable name to add menu item to.
         :param engine: Current engine where the action can be globally linked back to. (Not the App engine)
         """
-        MaxScript.add_action_to_menu(self.execute, self.name, menu_var, engine)
+        MaxScript.add_action_to_menu(self.execute, self.get_menu_label(), menu_var, engine)
@@ -0,0 +1,126 @@
+# Copyright (c) 2020 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+On demand profiling of the commands, hooks and idle tasks
+"""
+import cProfile
+import os
+import pstats
+import time
+
+from sgtk.util.filesystem import ensure_folder_exists
+
+# Number of functions listed in the text summary.
+SUMMARY_FUNCTION_COUNT = 30
+
+
+class ScopeProfiler(object):
+    """
+    Profiles the operations run in a :meth:`MaxEngine.perf_scope` between a
+    call to start and a call to stop, and writes the result to a folder.
+
+    Everything that runs outside of these operations, like Max itself, isn't
+    profiled.
+    """
+
+    def __init__(self, engine, folder):
+        """
+        Initialize Scope Profiler.
+        :param engine: Engine the operations are run by.
+        :param folder: Folder to write the profiles to.
+        """
+        self._engine = engine
+        self._folder = folder
+        self._profile = None
+        self._start = None
+        # Number of nested operations being profiled.
+        self._depth = 0
+        # Number of operations profiled, keyed by (category, name).
+        self._operations = {}
+
+    @property
+    def active(self):
+        """
+        True between a call to start and a call to stop.
+        """
+        return self._profile is not None
+
+    def start(self):
+        """
+        Starts profiling the operations.
+        """
+        if self.active:
+            return
+        self._profile = cProfile.Profile()
+        self._start = time.time()
+        self._depth = 0
+        self._operations = {}
+
+    def stop(self):
+        """
+        Stops profiling and writes the profile, as a .pstats file and a text
+        summary of the functions that took the most time.
+
+        :returns: Path of the text summary, or None if nothing was profiled.
+        """
+        if not self.active:
+            return None
+        profile = self._profile
+        self._profile = None
+        if self._depth:
+            # Stopped from within a profiled operation, e.g. a menu command.
+            profile.disable()
+            self._depth = 0
+
+        if not self._operations:
+            return None
+
+        base_path = os.path.join(
+            self._folder,
+            "tk-3dsmaxplus-profile-%s-%d" % (time.strftime("%Y%m%d-%H%M%S", time.localtime(self._start)), os.getpid())
+        )
+        ensure_folder_exists(self._folder)
+        profile.dump_stats(base_path + ".pstats")
+
+        with open(base_path + ".txt", "w") as summary_fh:
+            summary_fh.write("Profiled for %.1f seconds.\n\n" % (time.time() - self._start))
+            summary_fh.write("Profiled operations:\n")
+            for ((category, name), count) in sorted(self._operations.items()):
+                summary_fh.write("  %s: %s (%d time(s))\n" % (category, name, count))
+            summary_fh.write("\n")
+            stats = pstats.Stats(profile, stream=summary_fh)
+            stats.sort_stats("cumulative").print_stats(SUMMARY_FUNCTION_COUNT)
+
+        return base_path + ".txt"
+
+    def enter(self, category, name):
+        """
+        Starts profiling an operation. Must be followed by a call to exit.
+
+        :param category: Kind of operation.
+        :param name: Name of the operation.
+        """
+        key = (category, name)
+        self._operations[key] = self._operations.get(key, 0) + 1
+        self._depth += 1
+        if self._depth == 1:
+            self._profile.enable()
+
+    def exit(self):
+        """
+        Stops profiling the operation started by the last call to enter.
+        """
+        if self._profile is None or not self._depth:
+            # Profiling was stopped during the operation.
+            return
+        self._depth -= 1
+        if not self._depth:
+            self._profile.disable()
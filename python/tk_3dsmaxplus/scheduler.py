@@ -0,0 +1,167 @@
+# Copyright (c) 2020 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Scheduling of work on the 3ds Max main thread while it is idle
+"""
+import heapq
+import itertools
+import time
+import traceback
+
+from sgtk.platform.qt import QtCore
+
+
+class ScheduledTask(object):
+    """
+    A callable waiting to be run by the :class:`MainThreadScheduler`.
+    """
+
+    def __init__(self, callback, priority, estimated_cost, name):
+        """
+        Initialize Scheduled Task.
+        :param callback: Callable to run, without arguments.
+        :param priority: Priority of the task. Lower values run first.
+        :param estimated_cost: Estimated time the task takes to run, in milliseconds.
+        :param name: Name of the task, for logging purposes.
+        """
+        self.callback = callback
+        self.priority = priority
+        self.estimated_cost = estimated_cost
+        self.name = name
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Prevents the task from running, if it hasn't run yet.
+        """
+        self.cancelled = True
+
+
+class MainThreadScheduler(object):
+    """
+    Runs tasks on the main thread when the Qt event loop has nothing else to
+    do, in priority order.
+
+    Tasks are run in slices: a slice runs tasks until running the next one
+    would exceed the time budget, going by the tasks' estimated cost, and then
+    hands control back to the event loop so that Max stays interactive. A
+    slice always runs at least one task.
+    """
+
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 50
+    PRIORITY_LOW = 100
+
+    def __init__(self, engine, time_budget):
+        """
+        Initialize Main Thread Scheduler.
+        :param engine: Engine the tasks are run for.
+        :param time_budget: Maximum time to spend in a slice, in milliseconds.
+        """
+        self._engine = engine
+        self._time_budget = time_budget
+        self._queue = []
+        # Keeps tasks of the same priority in submission order.
+        self._counter = itertools.count()
+        self._shut_down = False
+
+        self._metrics = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "slices": 0,
+            "slice_overruns": 0,
+            "max_queue_depth": 0,
+            "max_slice_duration": 0.0,
+        }
+
+        # A zero timeout timer fires whenever the event loop is idle.
+        self._timer = QtCore.QTimer()
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._run_slice)
+
+    @property
+    def metrics(self):
+        """
+        Dictionary of counters describing the work done so far. Durations are
+        in milliseconds.
+        """
+        metrics = dict(self._metrics)
+        metrics["queue_depth"] = len(self._queue)
+        return metrics
+
+    def submit(self, callback, priority=PRIORITY_NORMAL, estimated_cost=1, name=None):
+        """
+        Queues a task to run when the main thread is idle.
+
+        :param callback: Callable to run, without arguments.
+        :param priority: Priority of the task. Lower values run first.
+        :param estimated_cost: Estimated time the task takes to run, in milliseconds.
+        :param name: Name of the task, for logging purposes. Defaults to the name of the callback.
+        :returns: :class:`ScheduledTask` instance, which can be used to cancel the task.
+        """
+        task = ScheduledTask(callback, priority, estimated_cost, name or getattr(callback, "__name__", repr(callback)))
+        if self._shut_down:
+            task.cancel()
+            return task
+
+        heapq.heappush(self._queue, (priority, next(self._counter), task))
+        self._metrics["submitted"] += 1
+        self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], len(self._queue))
+        if not self._timer.isActive():
+            self._timer.start()
+        return task
+
+    def shutdown(self):
+        """
+        Stops running tasks and discards the ones still queued.
+        """
+        self._shut_down = True
+        self._timer.stop()
+        self._metrics["cancelled"] += len(self._queue)
+        self._queue = []
+
+    def _run_slice(self):
+        """
+        Runs queued tasks until the time budget of the slice is spent.
+        """
+        self._metrics["slices"] += 1
+        start = time.time()
+        elapsed = 0.0
+        ran_task = False
+
+        while self._queue:
+            task = self._queue[0][2]
+            if task.cancelled:
+                heapq.heappop(self._queue)
+                self._metrics["cancelled"] += 1
+                continue
+            if ran_task and elapsed + task.estimated_cost > self._time_budget:
+                break
+
+            heapq.heappop(self._queue)
+            ran_task = True
+            try:
+                with self._engine.perf_scope("idle task", task.name):
+                    task.callback()
+                self._metrics["completed"] += 1
+            except Exception:
+                self._metrics["failed"] += 1
+                self._engine.log_error("Scheduled task '%s' failed: %s" % (task.name, traceback.format_exc()))
+            elapsed = (time.time() - start) * 1000.0
+
+        if elapsed > self._time_budget:
+            self._metrics["slice_overruns"] += 1
+        self._metrics["max_slice_duration"] = max(self._metrics["max_slice_duration"], elapsed)
+
+        if not self._queue:
+            self._timer.stop()
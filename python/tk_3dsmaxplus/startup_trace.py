@@ -0,0 +1,144 @@
+# Copyright (c) 2020 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Timeline of the 3ds Max startup, from the launch to the usable menu
+"""
+import contextlib
+import json
+import os
+import time
+
+from sgtk.util.filesystem import ensure_folder_exists
+
+# Time, as returned by time.time(), at which the launcher started 3ds Max.
+# Set by startup.py.
+LAUNCH_TIME_ENV_VAR = "SGTK_3DSMAX_LAUNCH_TIME"
+
+# JSON list of [name, start, end] spans recorded by python/startup/bootstrap.py.
+BOOTSTRAP_SPANS_ENV_VAR = "SGTK_3DSMAX_STARTUP_SPANS"
+
+
+class StartupTrace(object):
+    """
+    Collects named time spans over the startup and writes them as a Chrome
+    trace, which can be opened in chrome://tracing or https://ui.perfetto.dev.
+
+    The spans recorded before the engine starts, by startup.py and
+    bootstrap.py, are passed along through environment variables.
+    """
+
+    def __init__(self):
+        """
+        Initialize Startup Trace.
+        """
+        self._spans = []
+        self._finished = False
+
+    @property
+    def finished(self):
+        """
+        True once :meth:`finish` has been called. Spans aren't recorded anymore.
+        """
+        return self._finished
+
+    def add_span(self, name, start, end, category="engine"):
+        """
+        Records a span.
+
+        :param str name: Name of the span.
+        :param float start: Start time, as returned by time.time().
+        :param float end: End time, as returned by time.time().
+        :param str category: Category of the span.
+        """
+        if not self._finished:
+            self._spans.append((name, category, start, end))
+
+    @contextlib.contextmanager
+    def span(self, name, category="engine"):
+        """
+        Context manager recording a span for the code it wraps.
+
+        :param str name: Name of the span.
+        :param str category: Category of the span.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.time(), category)
+
+    def finish(self):
+        """
+        Adds the spans recorded before the engine started and stops recording.
+
+        The environment variables they were passed through are cleared, so
+        that they don't leak into the processes started from 3ds Max.
+        :returns: Start time of the trace, i.e. the launch time if known.
+        """
+        self._finished = True
+
+        bootstrap_spans = os.environ.pop(BOOTSTRAP_SPANS_ENV_VAR, None)
+        if bootstrap_spans:
+            try:
+                for (name, start, end) in json.loads(bootstrap_spans):
+                    self._spans.append((name, "bootstrap", start, end))
+            except ValueError:
+                pass
+
+        launch_time = os.environ.pop(LAUNCH_TIME_ENV_VAR, None)
+        first_start = min(span[2] for span in self._spans) if self._spans else time.time()
+        if launch_time:
+            try:
+                launch_time = float(launch_time)
+            except ValueError:
+                launch_time = None
+        if launch_time and launch_time < first_start:
+            self._spans.append(("3dsMax startup", "max", launch_time, first_start))
+            first_start = launch_time
+
+        self._spans.sort(key=lambda span: span[2])
+        return first_start
+
+    def summary(self, start, end):
+        """
+        :param float start: Start time of the trace, as returned by finish.
+        :param float end: Time at which the startup is considered done.
+        :returns: One line summary of the startup duration and its longest spans.
+        """
+        longest = sorted(self._spans, key=lambda span: span[3] - span[2], reverse=True)[:5]
+        return "Startup took %.2f s: %s" % (
+            end - start,
+            ", ".join("%s %.0f ms" % (span[0], (span[3] - span[2]) * 1000.0) for span in longest)
+        )
+
+    def write(self, path, start):
+        """
+        Writes the spans as a Chrome trace-event JSON file.
+
+        :param str path: Path of the file to write.
+        :param float start: Start time of the trace, as returned by finish.
+        """
+        pid = os.getpid()
+        events = []
+        for (name, category, span_start, span_end) in self._spans:
+            events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": int((span_start - start) * 1000000),
+                "dur": int((span_end - span_start) * 1000000),
+                "pid": pid,
+                "tid": 1,
+            })
+
+        ensure_folder_exists(os.path.dirname(path))
+        with open(path, "w") as trace_fh:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_fh)
@@ -14,9 +14,17 @@ Displays a message inviting the user to switch their Max engine to tk-3dsmax.
 
 import sgtk
 from sgtk.platform.qt import QtCore, QtGui
-from .ui.update_engine import Ui_UpdateEngine
 
-settings = sgtk.platform.import_framework("tk-framework-shotgunutils", "settings")
+
+def _get_user_settings():
+    """
+    Imports the shotgunutils framework on first use, rather than when this
+    module is imported.
+
+    :returns: A ``UserSettings`` instance for the current bundle.
+    """
+    settings = sgtk.platform.import_framework("tk-framework-shotgunutils", "settings")
+    return settings.UserSettings(sgtk.platform.current_bundle())
 
 
 class UpdateEngineDlg(QtGui.QDialog):
@@ -32,7 +40,7 @@ class UpdateEngineDlg(QtGui.QDialog):
         :returns: ``True`` if the user dismissed the dialog with "Do not show this again"
             checked in the past, ``False`` otherwise.
         """
-        settings_manager = settings.UserSettings(sgtk.platform.current_bundle())
+        settings_manager = _get_user_settings()
         return settings_manager.retrieve("skip_update_engine_dialog", False)
 
     def __init__(self, parent=None):
@@ -40,6 +48,10 @@ class UpdateEngineDlg(QtGui.QDialog):
         Init.
         """
         super(UpdateEngineDlg, self).__init__(parent)
+
+        # The UI is only needed when the dialog is actually shown.
+        from .ui.update_engine import Ui_UpdateEngine
+
         self._ui = Ui_UpdateEngine()
         self._ui.setupUi(self)
         self._ui.ok_button.clicked.connect(self._on_ok_clicked)
@@ -56,7 +68,7 @@ class UpdateEngineDlg(QtGui.QDialog):
         """
         Update user settings so that the dialog is never shown again.
         """
-        settings_manager = settings.UserSettings(sgtk.platform.current_bundle())
+        settings_manager = _get_user_settings()
         settings_manager.store("skip_update_engine_dialog", True)
 
 
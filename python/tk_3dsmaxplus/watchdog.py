@@ -0,0 +1,170 @@
+# Copyright (c) 2020 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Detection and reporting of main thread stalls
+"""
+import os
+import sys
+import threading
+import time
+
+from sgtk.platform.qt import QtCore
+from sgtk.util.filesystem import ensure_folder_exists
+
+# Maximum number of frames kept in a sampled stack.
+MAX_STACK_DEPTH = 100
+
+
+class StallWatchdog(object):
+    """
+    Watches the main thread for stalls and reports what it was doing.
+
+    The main thread posts heartbeats from a Qt timer. A background thread
+    checks them and, once the main thread hasn't posted one for longer than
+    the threshold, samples the main thread stack until it recovers. The
+    samples are then written to a report in the collapsed stack format used
+    by flame graph tools, along with the operations that were active.
+
+    When Max isn't stalled the cost is a timer tick on the main thread and
+    a wake up of the background thread every half threshold.
+    """
+
+    def __init__(self, engine, threshold, sample_interval, report_folder):
+        """
+        Initialize Stall Watchdog.
+        :param engine: Engine to report the stalls for. Must be called from the main thread.
+        :param threshold: Time without heartbeat after which the main thread is considered stalled, in milliseconds.
+        :param sample_interval: Time between two stack samples during a stall, in milliseconds.
+        :param report_folder: Folder to write the reports to.
+        """
+        self._engine = engine
+        self._threshold = threshold / 1000.0
+        self._sample_interval = sample_interval / 1000.0
+        self._report_folder = report_folder
+        self._main_thread_id = threading.current_thread().ident
+
+        self._last_heartbeat = time.time()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._timer = QtCore.QTimer()
+        self._timer.setInterval(int(threshold / 4) or 1)
+        self._timer.timeout.connect(self._heartbeat)
+
+    def start(self):
+        """
+        Starts watching the main thread.
+        """
+        self._last_heartbeat = time.time()
+        self._timer.start()
+        self._thread = threading.Thread(target=self._watch, name="tk-3dsmaxplus-stall-watchdog")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops watching the main thread.
+        """
+        self._timer.stop()
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1)
+            self._thread = None
+
+    def _heartbeat(self):
+        """
+        Called on the main thread by the timer.
+        """
+        self._last_heartbeat = time.time()
+
+    def _watch(self):
+        """
+        Watchdog thread loop.
+        """
+        while not self._stop.wait(self._threshold / 2):
+            stall_start = self._last_heartbeat
+            if time.time() - stall_start > self._threshold:
+                self._sample_stall(stall_start)
+
+    def _sample_stall(self, stall_start):
+        """
+        Samples the main thread stack until the main thread recovers, then
+        writes a report.
+
+        :param stall_start: Time of the last heartbeat before the stall.
+        """
+        samples = {}
+        operations = []
+        while self._last_heartbeat == stall_start and not self._stop.is_set():
+            frame = sys._current_frames().get(self._main_thread_id)
+            if frame is not None:
+                stack = self._collapse_stack(frame)
+                samples[stack] = samples.get(stack, 0) + 1
+            # Frames hold references to everything in scope, don't keep them around.
+            frame = None
+
+            for operation in self._engine.active_operations:
+                if operation not in operations:
+                    operations.append(operation)
+            self._stop.wait(self._sample_interval)
+
+        self._write_report(stall_start, time.time() - stall_start, samples, operations)
+
+    @staticmethod
+    def _collapse_stack(frame):
+        """
+        :param frame: Innermost frame of the stack.
+        :returns: The stack as a semicolon separated string, outermost frame first.
+        """
+        names = []
+        while frame is not None and len(names) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            names.append(
+                "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), frame.f_lineno)
+            )
+            frame = frame.f_back
+        return ";".join(reversed(names)).replace(" ", "_")
+
+    def _write_report(self, stall_start, duration, samples, operations):
+        """
+        Writes a stall report to the report folder and logs its location.
+
+        :param stall_start: Time of the last heartbeat before the stall.
+        :param duration: Duration of the stall, in seconds.
+        :param samples: Dictionary of sample counts keyed by collapsed stack.
+        :param operations: List of (category, name, start time) tuples of the active operations.
+        """
+        path = os.path.join(
+            self._report_folder,
+            "tk-3dsmaxplus-stall-%s-%d.txt" % (time.strftime("%Y%m%d-%H%M%S", time.localtime(stall_start)), os.getpid())
+        )
+        try:
+            ensure_folder_exists(self._report_folder)
+            with open(path, "w") as report_fh:
+                report_fh.write("# Main thread stalled for %.0f ms\n" % (duration * 1000.0))
+                for (category, name, start) in operations:
+                    report_fh.write(
+                        "# Active %s: %s (started %.0f ms before the stall)\n" % (
+                            category, name, max(0.0, stall_start - start) * 1000.0
+                        )
+                    )
+                for (stack, count) in sorted(samples.items(), key=lambda item: item[1], reverse=True):
+                    report_fh.write("%s %d\n" % (stack, count))
+        except Exception as e:
+            self._engine.async_execute_in_main_thread(
+                self._engine.log_warning, "Could not write the stall report '%s': %s" % (path, e)
+            )
+            return
+
+        self._engine.async_execute_in_main_thread(
+            self._engine.log_warning,
+            "3dsMax was unresponsive for %.1f seconds. Stall report written to %s" % (duration, path)
+        )
@@ -0,0 +1,320 @@
+# Copyright (c) 2020 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Worker threads for pure python work, like file system access, that would
+otherwise block the 3ds Max main thread
+"""
+import functools
+import threading
+import traceback
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# Set on the worker threads, see is_worker_thread.
+_thread_data = threading.local()
+
+
+def is_worker_thread():
+    """
+    :returns: True if the calling thread is a :class:`WorkerPool` thread.
+    """
+    return getattr(_thread_data, "is_worker", False)
+
+
+def main_thread_only(func):
+    """
+    Decorator for functions that use MaxPlus, which must not be called from
+    a :class:`WorkerPool` thread.
+
+    :raises RuntimeError: When the decorated function is called from a worker thread.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if is_worker_thread():
+            raise RuntimeError(
+                "%s uses MaxPlus and can't be called from the worker thread '%s'." % (
+                    func.__name__, threading.current_thread().name
+                )
+            )
+        return func(*args, **kwargs)
+    return wrapper
+
+
+class Future(object):
+    """
+    Result of a task submitted to a :class:`WorkerPool`.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    CANCELLED = "cancelled"
+
+    def __init__(self, engine, func, args, kwargs):
+        """
+        Initialize Future.
+        :param engine: Engine used to run the done callbacks on the main thread.
+        :param func: Callable to run on a worker thread.
+        :param args: Positional arguments for the callable.
+        :param kwargs: Keyword arguments for the callable.
+        """
+        self._engine = engine
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._state = self.PENDING
+        self._result = None
+        self._exception = None
+        self._traceback = None
+        self._callbacks = []
+
+    @property
+    def state(self):
+        """
+        One of ``PENDING``, ``RUNNING``, ``DONE`` or ``CANCELLED``.
+        """
+        return self._state
+
+    def cancel(self):
+        """
+        Cancels the task if it hasn't started running yet.
+
+        :returns: True if the task is cancelled, False if it is running or done.
+        """
+        with self._lock:
+            if self._state == self.RUNNING or self._state == self.DONE:
+                return False
+            if self._state == self.PENDING:
+                self._state = self.CANCELLED
+                self._finished.set()
+                callbacks = self._callbacks
+                self._callbacks = []
+            else:
+                callbacks = []
+        self._schedule_callbacks(callbacks)
+        return True
+
+    def cancelled(self):
+        """
+        :returns: True if the task was cancelled.
+        """
+        return self._state == self.CANCELLED
+
+    def done(self):
+        """
+        :returns: True if the task has run or was cancelled.
+        """
+        return self._finished.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits for the task to finish and returns its result.
+
+        Avoid calling this from the main thread without a timeout, as it
+        blocks 3ds Max until the task is done.
+
+        :param timeout: Maximum time to wait, in seconds. Waits forever when None.
+        :returns: The value returned by the task.
+        :raises RuntimeError: If the task was cancelled or the timeout expired.
+        :raises: The exception raised by the task, if any.
+        """
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Waits for the task to finish and returns the exception it raised.
+
+        :param timeout: Maximum time to wait, in seconds. Waits forever when None.
+        :returns: The exception raised by the task, or None.
+        :raises RuntimeError: If the task was cancelled or the timeout expired.
+        """
+        self._wait(timeout)
+        return self._exception
+
+    @property
+    def traceback(self):
+        """
+        Formatted traceback of the exception raised by the task, or None.
+        """
+        return self._traceback
+
+    def add_done_callback(self, callback):
+        """
+        Registers a callable to run on the main thread once the task is done
+        or cancelled. The future is passed to it as its only argument.
+
+        :param callback: Callable to run.
+        """
+        with self._lock:
+            if not self._finished.is_set():
+                self._callbacks.append(callback)
+                return
+        self._schedule_callbacks([callback])
+
+    def _wait(self, timeout):
+        """
+        Waits for the task to finish.
+
+        :param timeout: Maximum time to wait, in seconds. Waits forever when None.
+        :raises RuntimeError: If the task was cancelled or the timeout expired.
+        """
+        if not self._finished.wait(timeout):
+            raise RuntimeError("Timed out after %s seconds waiting for %s." % (timeout, self._func))
+        if self._state == self.CANCELLED:
+            raise RuntimeError("%s was cancelled." % self._func)
+
+    def _run(self):
+        """
+        Runs the task. Called from a worker thread.
+        """
+        with self._lock:
+            if self._state != self.PENDING:
+                return
+            self._state = self.RUNNING
+
+        try:
+            self._result = self._func(*self._args, **self._kwargs)
+        except Exception as e:
+            self._exception = e
+            self._traceback = traceback.format_exc()
+
+        with self._lock:
+            self._state = self.DONE
+            self._finished.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        self._schedule_callbacks(callbacks)
+
+    def _schedule_callbacks(self, callbacks):
+        """
+        Runs the done callbacks on the main thread.
+
+        :param callbacks: Callables to run.
+        """
+        for callback in callbacks:
+            self._engine.async_execute_in_main_thread(self._run_callback, callback)
+
+    def _run_callback(self, callback):
+        """
+        Runs a done callback, logging the errors it raises.
+
+        :param callback: Callable to run.
+        """
+        try:
+            callback(self)
+        except Exception:
+            self._engine.log_error("Worker task callback failed: %s" % traceback.format_exc())
+
+
+class WorkerPool(object):
+    """
+    Small pool of threads running pure python tasks, like file system access,
+    off the main thread.
+
+    MaxPlus isn't thread-safe, so the tasks must not use it. The functions
+    decorated with :func:`main_thread_only` raise when called from a task.
+    Results are delivered on the main thread through the done callbacks of
+    the :class:`Future` returned by :meth:`submit`.
+    """
+
+    def __init__(self, engine, worker_count):
+        """
+        Initialize Worker Pool.
+        :param engine: Engine the tasks are run for.
+        :param worker_count: Number of worker threads.
+        """
+        self._engine = engine
+        self._worker_count = max(1, worker_count)
+        self._queue = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._shut_down = False
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queues a callable to run on a worker thread.
+
+        The threads are started the first time this is called.
+        :param func: Callable to run. It must not use MaxPlus.
+        :param args: Positional arguments for the callable.
+        :param kwargs: Keyword arguments for the callable.
+        :returns: :class:`Future` instance.
+        :raises RuntimeError: If the pool has been shut down.
+        """
+        future = Future(self._engine, func, args, kwargs)
+        with self._lock:
+            if self._shut_down:
+                raise RuntimeError("The worker pool has been shut down.")
+            self._start_workers()
+            self._queue.put(future)
+        return future
+
+    def shutdown(self, timeout=None):
+        """
+        Cancels the queued tasks and stops the worker threads.
+
+        :param timeout: Maximum time to wait for each running task to finish,
+            in seconds. Waits forever when None.
+        """
+        with self._lock:
+            if self._shut_down:
+                return
+            self._shut_down = True
+
+        # Cancel what hasn't started yet.
+        while True:
+            try:
+                future = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            future.cancel()
+
+        # One sentinel per thread to wake them up.
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                self._engine.log_warning("Worker thread '%s' is still running a task." % worker.name)
+        self._workers = []
+
+    def _start_workers(self):
+        """
+        Starts the worker threads, if they aren't running already.
+        """
+        if self._workers:
+            return
+        for index in range(self._worker_count):
+            worker = threading.Thread(target=self._work, name="tk-3dsmaxplus-worker-%d" % index)
+            # Don't keep Max from exiting if a task hangs.
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        """
+        Worker thread loop.
+        """
+        _thread_data.is_worker = True
+        while True:
+            future = self._queue.get()
+            if future is None:
+                return
+            future._run()
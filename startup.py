@@ -8,14 +8,41 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
+import hashlib
+import json
 import os
 import re
+import shutil
 import sys
+import tempfile
+import time
 import sgtk
 
 from sgtk.platform import SoftwareLauncher, SoftwareVersion, LaunchInformation
 from tank_vendor.shotgun_api3.lib import six
 
+# Folders of the engine, relative to its root, copied locally when the
+# launch_shadow_copy setting is on. They hold everything 3dsMax imports
+# before the engine starts.
+SHADOW_COPY_FOLDERS = [
+    os.path.join("python", "startup"),
+    os.path.join("python", "tk_3dsmaxplus"),
+    "plugins",
+    os.path.join("resources", "ssl_fix"),
+]
+
+# Name of the file, at the root of a shadow copy, listing the files it holds.
+SHADOW_COPY_MANIFEST = "shadow_copy_manifest.json"
+
+# Each launch writes its context to a temporary folder with this prefix, which
+# python/startup/bootstrap.py deletes once it has read it. Folders left behind
+# by a 3dsMax that didn't get that far are deleted once they are older than
+# CONTEXT_HANDOFF_MAX_AGE seconds.
+CONTEXT_HANDOFF_PREFIX = "tk-3dsmaxplus-launch-"
+CONTEXT_HANDOFF_FILE = "context.json"
+CONTEXT_HANDOFF_VERSION = 1
+CONTEXT_HANDOFF_MAX_AGE = 24 * 60 * 60
+
 
 class MaxLauncher(SoftwareLauncher):
     """
@@ -100,7 +127,16 @@ class MaxLauncher(SoftwareLauncher):
 
         required_env = {}
 
-        startup_file = os.path.join(self.disk_location, "python", "startup", "bootstrap.py")
+        # Files that 3dsMax reads before the engine starts are read from here.
+        engine_root = self.disk_location
+        if self.get_setting("launch_shadow_copy"):
+            try:
+                engine_root = self._sync_shadow_copy()
+                required_env["SGTK_3DSMAX_SHADOW_COPY"] = engine_root
+            except Exception as e:
+                self.logger.warning("Could not make a local copy of the engine, using '%s': %s" % (engine_root, e))
+
+        startup_file = os.path.join(engine_root, "python", "startup", "bootstrap.py")
         new_args = "-U PythonHost \"%s\"" % startup_file
 
         if args:
@@ -120,7 +156,7 @@ class MaxLauncher(SoftwareLauncher):
             load_max_plugins = []
 
             for find_plugin in find_plugins:
-                load_plugin = os.path.join(self.disk_location, "plugins", find_plugin)
+                load_plugin = os.path.join(engine_root, "plugins", find_plugin)
                 if os.path.exists(load_plugin):
                     self.logger.debug("Preparing to launch builtin plugin '%s'" % load_plugin)
                     load_max_plugins.append(load_plugin)
@@ -130,6 +166,20 @@ class MaxLauncher(SoftwareLauncher):
 
             required_env["SGTK_LOAD_MAX_PLUGINS"] = os.pathsep.join(load_max_plugins)
 
+            deferred_bootstrap = self.get_setting("launch_deferred_bootstrap")
+            if deferred_bootstrap:
+                # Read by the basic plugin, see its bootstrap_toolkit function.
+                required_env["SGTK_3DSMAX_DEFERRED_BOOTSTRAP"] = str(deferred_bootstrap)
+
+            if self.get_setting("launch_prefetch_config"):
+                # Read by the basic plugin, see its bootstrap_toolkit function.
+                required_env["SGTK_3DSMAX_PREFETCH_CONFIG"] = "1"
+
+            if self.get_setting("launch_cached_menu"):
+                # Written by the engine and read by the basic plugin, see its
+                # bootstrap_toolkit function.
+                required_env["SGTK_3DSMAX_MENU_MANIFEST"] = self._get_menu_manifest_path()
+
             # Add context and site info
             std_env = self.get_standard_plugin_environment()
             required_env.update(std_env)
@@ -139,14 +189,144 @@ class MaxLauncher(SoftwareLauncher):
             # classic bootstrap approach.
             self.logger.debug("Preparing 3dsMax Launch via Toolkit Classic methodology ...")
             required_env["TANK_ENGINE"] = self.engine_name
-            required_env["TANK_CONTEXT"] = self.context.serialize(use_json=True)
+            try:
+                required_env["SGTK_3DSMAX_CONTEXT_HANDOFF"] = self._write_context_handoff()
+            except Exception as e:
+                self.logger.warning("Could not write the context to a file, passing it in TANK_CONTEXT: %s" % e)
+                required_env["TANK_CONTEXT"] = self.context.serialize(use_json=True)
 
         if file_to_open:
             # Add the file name to open to the launch environment
             required_env["SGTK_FILE_TO_OPEN"] = file_to_open
 
+            # Read by python/startup/bootstrap.py.
+            if self.get_setting("launch_file_prefetch"):
+                required_env["SGTK_3DSMAX_FILE_PREFETCH"] = "1"
+            required_env["SGTK_3DSMAX_FILE_OPEN_ORDER"] = self.get_setting("launch_file_open_order")
+
+        # Lets the engine include the time 3dsMax itself takes to start in
+        # its startup trace.
+        required_env["SGTK_3DSMAX_LAUNCH_TIME"] = "%f" % time.time()
+
         return LaunchInformation(exec_path, args, required_env)
 
+    def _write_context_handoff(self):
+        """
+        Writes the serialized context to a file in a temporary folder of its
+        own, rather than passing it in the environment, where large contexts
+        run into size limits. The serialized context holds the entity
+        dictionaries of the context, so 3dsMax doesn't need to look them up.
+
+        Handoff folders left behind by earlier launches are deleted first.
+
+        :returns: Path of the file written.
+        """
+        temp_root = tempfile.gettempdir()
+        for name in os.listdir(temp_root):
+            if not name.startswith(CONTEXT_HANDOFF_PREFIX):
+                continue
+            path = os.path.join(temp_root, name)
+            try:
+                if time.time() - os.path.getmtime(path) > CONTEXT_HANDOFF_MAX_AGE:
+                    shutil.rmtree(path)
+            except OSError as e:
+                self.logger.debug("Could not delete the stale context handoff '%s': %s" % (path, e))
+
+        handoff_path = os.path.join(tempfile.mkdtemp(prefix=CONTEXT_HANDOFF_PREFIX), CONTEXT_HANDOFF_FILE)
+        with open(handoff_path, "w") as handoff_fh:
+            json.dump({"version": CONTEXT_HANDOFF_VERSION, "context": self.context.serialize(use_json=True)}, handoff_fh)
+        return handoff_path
+
+    def _get_menu_manifest_path(self):
+        """
+        :returns: Path of the manifest of the last menu built by the engine
+            for the configuration and type of context 3dsMax is launched in.
+        """
+        if self.context.entity:
+            context_type = self.context.entity["type"]
+        else:
+            context_type = "Project" if self.context.project else "Site"
+        return os.path.join(
+            sgtk.util.LocalFileStorageManager.get_global_root(sgtk.util.LocalFileStorageManager.CACHE),
+            "tk-3dsmaxplus-menus",
+            "%s-%s.json" % (
+                hashlib.md5(self.sgtk.pipeline_configuration.get_path().encode("utf-8")).hexdigest()[:8],
+                context_type
+            )
+        )
+
+    def _sync_shadow_copy(self):
+        """
+        Copies the startup scripts, plugins, resources and python package of
+        the engine to a local folder, so that 3dsMax doesn't read them over the
+        network.
+
+        Each engine install gets its own folder. A manifest of the size,
+        modification time and hash of each file is kept along with the copy,
+        so that only the files that changed since the last launch are copied.
+
+        :returns: Root folder of the local copy.
+        """
+        start = time.time()
+        root = os.path.join(
+            sgtk.util.LocalFileStorageManager.get_global_root(sgtk.util.LocalFileStorageManager.CACHE),
+            "tk-3dsmaxplus-shadow",
+            "%s-%s" % (
+                os.path.basename(self.disk_location),
+                hashlib.md5(self.disk_location.encode("utf-8")).hexdigest()[:8]
+            )
+        )
+        manifest_path = os.path.join(root, SHADOW_COPY_MANIFEST)
+        try:
+            with open(manifest_path, "r") as manifest_fh:
+                manifest = json.load(manifest_fh)
+        except (IOError, OSError, ValueError):
+            manifest = {}
+
+        new_manifest = {}
+        copied = 0
+        for folder in SHADOW_COPY_FOLDERS:
+            for (dir_path, dir_names, file_names) in os.walk(os.path.join(self.disk_location, folder)):
+                for file_name in file_names:
+                    if file_name.endswith((".pyc", ".pyo")):
+                        # Compiled locally, see python/startup/bootstrap.py.
+                        continue
+                    source = os.path.join(dir_path, file_name)
+                    relative_path = os.path.relpath(source, self.disk_location)
+                    target = os.path.join(root, relative_path)
+                    stat = os.stat(source)
+                    entry = manifest.get(relative_path)
+                    if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime and os.path.exists(target):
+                        new_manifest[relative_path] = entry
+                        continue
+
+                    digest = _hash_file(source)
+                    if not (entry and entry[2] == digest and os.path.exists(target)):
+                        sgtk.util.filesystem.ensure_folder_exists(os.path.dirname(target))
+                        shutil.copy2(source, target)
+                        copied += 1
+                    new_manifest[relative_path] = [stat.st_size, stat.st_mtime, digest]
+
+        # Remove the files that are gone from the engine.
+        for relative_path in set(manifest) - set(new_manifest):
+            try:
+                os.remove(os.path.join(root, relative_path))
+            except OSError:
+                pass
+
+        # Also saves the modification times that changed without the content
+        # changing, so that these files aren't hashed again at every launch.
+        if new_manifest != manifest:
+            sgtk.util.filesystem.ensure_folder_exists(root)
+            with open(manifest_path, "w") as manifest_fh:
+                json.dump(new_manifest, manifest_fh)
+
+        self.logger.debug(
+            "Local copy of the engine in '%s' synced in %.0f ms, %d file(s) copied." %
+            (root, (time.time() - start) * 1000.0, copied)
+        )
+        return root
+
     def _find_software(self):
         """
         Find executables in the Windows Registry.
@@ -195,6 +375,18 @@ class MaxLauncher(SoftwareLauncher):
         return sw_versions
 
 
+def _hash_file(path):
+    """
+    :param str path: Path of the file to hash.
+    :returns: SHA-1 of the file content, as an hexadecimal string.
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as file_fh:
+        for chunk in iter(lambda: file_fh.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def _get_installation_paths_from_registry(logger):
     """
     Query Windows registry for 3dsMax installations.
@@ -0,0 +1,64 @@
+# Copyright (c) 2020 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Stand-ins for the modules only available inside 3ds Max with Toolkit, so
+that the parts of the engine that don't need them can be tested outside of it.
+"""
+import os
+import sys
+import types
+
+PYTHON_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "python")
+
+
+def _add_module(name, **attributes):
+    """
+    Registers an empty module in sys.modules, unless a module of that name exists.
+
+    :param name: Full name of the module.
+    :param attributes: Attributes to set on the module.
+    :returns: The module.
+    """
+    module = sys.modules.get(name)
+    if module is None:
+        module = sys.modules[name] = types.ModuleType(name)
+        if "." in name:
+            (parent, child) = name.rsplit(".", 1)
+            setattr(sys.modules[parent], child, module)
+    for (key, value) in attributes.items():
+        setattr(module, key, value)
+    return module
+
+
+class _Core(object):
+    """
+    Stand-in for MaxPlus.Core, recording the evaluated scripts.
+    """
+    scripts = []
+
+    @staticmethod
+    def EvalMAXScript(script):
+        _Core.scripts.append(script)
+
+
+def install():
+    """
+    Registers the stand-in sgtk and MaxPlus modules, and makes the engine's
+    python folder importable.
+    """
+    _add_module("MaxPlus", Core=_Core)
+    _add_module("sgtk")
+    _add_module("sgtk.platform")
+    _add_module("sgtk.platform.qt", QtCore=None, QtGui=None)
+    _add_module("sgtk.util")
+    _add_module("sgtk.util.filesystem", ensure_folder_exists=lambda path: None)
+    if PYTHON_FOLDER not in sys.path:
+        sys.path.insert(0, PYTHON_FOLDER)
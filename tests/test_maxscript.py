@@ -0,0 +1,52 @@
+# Copyright (c) 2020 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stubs
+
+stubs.install()
+from tk_3dsmaxplus.maxscript import MaxScript
+
+
+class TestBridgeStats(unittest.TestCase):
+    """
+    Tests the call sites the MaxScript evaluations are counted against.
+    """
+
+    def setUp(self):
+        MaxScript.stats.reset()
+
+    def _get_sites(self):
+        return list(MaxScript.stats.summary()["sites"])
+
+    def test_direct_call_site(self):
+        """
+        A direct call is counted against its caller, not the main_thread_only wrapper.
+        """
+        line = sys._getframe().f_lineno + 1
+        MaxScript.evaluate("1 + 1")
+        self.assertEqual(self._get_sites(), ["test_maxscript.py:%d (test_direct_call_site)" % line])
+
+    def test_helper_call_site(self):
+        """
+        A call made through one of the MaxScript helpers is counted against
+        the code calling the helper.
+        """
+        line = sys._getframe().f_lineno + 1
+        MaxScript.add_separator("sgtk_menu")
+        self.assertEqual(self._get_sites(), ["test_maxscript.py:%d (test_helper_call_site)" % line])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+# Copyright (c) 2020 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+# Imports the package in a fresh interpreter and prints the modules loaded.
+IMPORT_SCRIPT = """
+import json, sys
+sys.path.insert(0, %r)
+import stubs
+stubs.install()
+before = set(sys.modules)
+import tk_3dsmaxplus
+print(json.dumps(sorted(set(sys.modules) - before)))
+""" % TESTS_FOLDER
+
+# Modules that must only be loaded when one of their members is used.
+HEAVY_MODULES = [
+    "tk_3dsmaxplus.menu_generation",
+    "tk_3dsmaxplus.maxscript",
+    "tk_3dsmaxplus.update_engine",
+    "tk_3dsmaxplus.lazy_apps",
+    "tk_3dsmaxplus.command_usage",
+    "tk_3dsmaxplus.scheduler",
+    "tk_3dsmaxplus.worker_pool",
+    "tk_3dsmaxplus.watchdog",
+    "tk_3dsmaxplus.memory_report",
+    "tk_3dsmaxplus.journal",
+    "tk_3dsmaxplus.profiler",
+    "tk_3dsmaxplus.startup_trace",
+]
+
+
+class TestPackageImport(unittest.TestCase):
+    """
+    Guards the import time budget of the tk_3dsmaxplus package.
+    """
+
+    def _import_package(self):
+        """
+        :returns: Names of the modules loaded by importing the package.
+        """
+        output = subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT])
+        return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+    def test_no_eager_imports(self):
+        """
+        Importing the package doesn't load its modules.
+        """
+        loaded = self._import_package()
+        self.assertEqual([name for name in HEAVY_MODULES if name in loaded], [])
+        self.assertEqual([name for name in loaded if "qt" in name.lower() or "PySide" in name], [])
+
+    def test_member_loads_its_module(self):
+        """
+        Accessing a member loads the module that defines it, and only that one.
+        """
+        script = IMPORT_SCRIPT.replace(
+            "import tk_3dsmaxplus\n", "import tk_3dsmaxplus\ntk_3dsmaxplus.StartupTrace\n"
+        )
+        output = subprocess.check_output([sys.executable, "-c", script])
+        loaded = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+        self.assertIn("tk_3dsmaxplus.startup_trace", loaded)
+        self.assertNotIn("tk_3dsmaxplus.menu_generation", loaded)
+
+
+if __name__ == "__main__":
+    unittest.main()